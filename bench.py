@@ -0,0 +1,373 @@
+"""Офлайн-бенчмарк бота з фейковими Telegram Bot API і Google Sheets.
+
+Проганяє повні бесіди додавання запису (модель → VIN → робота → опис) для N одночасних
+користувачів через ті самі ConversationHandler і PerChatUpdateProcessor, що й у продакшені,
+і друкує p50/p99 затримки кожного кроку та кількість записів за секунду.
+
+    python bench.py --users 50 --flows 10 --rows 20000 --sheets-latency 0.2
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import string
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+WORKS = ["Заміна фари", "Діагностика", "Заміна колодок", "Оновлення ПЗ", "Полірування", "Заміна скла"]
+
+class FakeRequest:
+    """Імітує виклик execute() клієнта googleapiclient із затримкою мережі"""
+
+    def __init__(self, backend: "FakeSheets", func):
+        self.backend = backend
+        self.func = func
+
+    def execute(self, http=None, num_retries=0):
+        self.backend.delay()
+        return self.func()
+
+class FakeValues:
+    def __init__(self, backend: "FakeSheets"):
+        self.backend = backend
+
+    def get(self, spreadsheetId: str, range: str, **kwargs) -> FakeRequest:
+        return FakeRequest(self.backend, lambda: self.backend.read(range))
+
+    def batchGet(self, spreadsheetId: str, ranges: List[str], **kwargs) -> FakeRequest:
+        dimension = kwargs.get("majorDimension", "ROWS")
+        return FakeRequest(self.backend, lambda: {"valueRanges": [self.backend.read(r, dimension) for r in ranges]})
+
+    def append(self, spreadsheetId: str, range: str, body: dict, **kwargs) -> FakeRequest:
+        return FakeRequest(self.backend, lambda: self.backend.append(range, body["values"]))
+
+class FakeSheets:
+    """Таблиця в пам'яті з інтерфейсом spreadsheets().get/batchUpdate і values().get/batchGet/append"""
+
+    A1_RANGE = re.compile(r"^([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?$")
+    # Нова вкладка має 1000 порожніх рядків, а append з INSERT_ROWS вставляє дані перед ними
+    BLANK_ROWS = 1000
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.tabs: Dict[str, List[List[str]]] = defaultdict(list)
+        self.calls: Counter = Counter()
+        self.rows_read = 0
+        self.cells_read = 0
+        self.rows_written = 0
+        self._lock = threading.Lock()
+
+    def values(self) -> FakeValues:
+        return FakeValues(self)
+
+    def get(self, spreadsheetId: str, **kwargs) -> FakeRequest:
+        return FakeRequest(self, lambda: {"sheets": [
+            {"properties": {"title": tab, "gridProperties": {"rowCount": len(rows) + self.BLANK_ROWS}}}
+            for tab, rows in list(self.tabs.items())
+        ]})
+
+    def batchUpdate(self, spreadsheetId: str, body: dict, **kwargs) -> FakeRequest:
+        def apply() -> dict:
+            with self._lock:
+                self.calls["batchUpdate"] += 1
+                for request in body["requests"]:
+                    self.tabs.setdefault(request["addSheet"]["properties"]["title"], [])
+            return {}
+        return FakeRequest(self, apply)
+
+    def delay(self) -> None:
+        # Блокуючий sleep: виклики виконуються в пулі потоків, як і справжній httplib2
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    @staticmethod
+    def _column(letters: str) -> int:
+        number = 0
+        for char in letters:
+            number = number * 26 + ord(char) - 64
+        return number
+
+    def _parse(self, range_name: str):
+        tab, _, a1 = range_name.partition("!")
+        match = self.A1_RANGE.match(a1)
+        first_col, first_row, last_col, last_row = match.groups() if a1 and match else ("", "", "", "")
+        return (
+            tab.strip("'"),
+            self._column(first_col) if first_col else 1,
+            int(first_row) if first_row else 1,
+            self._column(last_col) if last_col else None,
+            int(last_row) if last_row else None,
+        )
+
+    def read(self, range_name: str, dimension: str = "ROWS") -> dict:
+        tab, first_col, first_row, last_col, last_row = self._parse(range_name)
+        with self._lock:
+            self.calls["get"] += 1
+            rows = self.tabs[tab][first_row - 1:last_row]
+            values = [row[first_col - 1:last_col] for row in rows]
+            self.rows_read += len(values)
+            self.cells_read += sum(len(row) for row in values)
+        if dimension == "COLUMNS" and values:
+            width = max(len(row) for row in values)
+            values = [[row[col] if col < len(row) else "" for row in values] for col in range(width)]
+        return {"range": range_name, "values": values} if values else {"range": range_name}
+
+    def append(self, range_name: str, values: List[List]) -> dict:
+        tab = self._parse(range_name)[0]
+        with self._lock:
+            self.calls["append"] += 1
+            self.tabs[tab].extend([[str(value) for value in row] for row in values])
+            self.rows_written += len(values)
+        return {"updates": {"updatedRows": len(values)}}
+
+def random_vin(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_uppercase + string.digits, k=6))
+
+def prefill(sheet: FakeSheets, tab: str, month: str, headers: List[str], rows: int, rng: random.Random) -> List[str]:
+    """Заповнює вкладку синтетичними записами місяця month ("YYYY-MM") і повертає використані VIN"""
+    vins = [random_vin(rng) for _ in range(max(1, rows // 5))]
+    models = ["Model 3", "Model Y", "Model S", "Model X"]
+    data = [list(headers)]
+    for record_id in range(1, rows + 1):
+        day = 1 + record_id % 28
+        data.append([
+            str(record_id), f"{month}-{day:02d} 00:00:00", "@history", "Історія", "@history", "Історія",
+            rng.choice(models), rng.choice(vins), rng.choice(WORKS), "", "worker",
+        ])
+    sheet.tabs[tab] = data
+    return vins if rows else []
+
+def configure_environment(args: argparse.Namespace) -> None:
+    """Налаштовує змінні оточення до імпорту bot.py: тимчасові файли стану і синтетичні працівники"""
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    os.environ.update({
+        "BOT_TOKEN": "123456:bench",
+        "GOOGLE_SHEETS_SPREADSHEET_ID": "bench",
+        "JOURNAL_PATH": os.path.join(workdir, "records.db"),
+        "PERSISTENCE_PATH": os.path.join(workdir, "state.db"),
+        "ID_COUNTER_FILE": os.path.join(workdir, "last_id.txt"),
+        "METRICS_PORT": "0",
+        "USERS_FILE": "",
+        "OWNERS": "",
+        "MANAGERS": "",
+        "WORKERS": ",".join(f"@bench{i} Працівник {i}" for i in range(args.users)),
+    })
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+class FakeTelegramRequest(BaseRequest):
+    """Відповідає на виклики Bot API без мережі і пам'ятає останнє повідомлення кожного чату"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.last: Dict[int, dict] = {}
+        self._message_ids = itertools.count(1000)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        name = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if name == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif name in ("sendMessage", "editMessageText", "sendDocument"):
+            chat_id = int(params.get("chat_id", 0))
+            markup = params.get("reply_markup")
+            self.last[chat_id] = {
+                "text": params.get("text", ""),
+                "markup": json.loads(markup) if isinstance(markup, str) else markup,
+            }
+            result = {
+                "message_id": next(self._message_ids), "date": 0,
+                "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+class FlowDriver:
+    """Генерує оновлення Telegram для бесід синтетичних користувачів і вимірює кожен крок"""
+
+    def __init__(self, app, telegram, vins: List[str], rng: random.Random):
+        self.app = app
+        self.telegram = telegram
+        self.vins = vins
+        self.rng = rng
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.saved = 0
+        self.failed = 0
+        self._ids = itertools.count(1)
+
+    def _sender(self, user: int) -> dict:
+        return {"id": 10_000 + user, "is_bot": False, "first_name": "Bench", "username": f"bench{user}"}
+
+    def _chat(self, user: int) -> dict:
+        return {"id": 10_000 + user, "type": "private"}
+
+    def _message(self, user: int, text: str) -> dict:
+        return {"update_id": next(self._ids), "message": {
+            "message_id": next(self._ids), "date": int(time.time()),
+            "chat": self._chat(user), "from": self._sender(user), "text": text,
+        }}
+
+    def _callback(self, user: int, data: str) -> dict:
+        return {"update_id": next(self._ids), "callback_query": {
+            "id": str(next(self._ids)), "chat_instance": "bench", "data": data, "from": self._sender(user),
+            "message": {"message_id": 1, "date": int(time.time()), "chat": self._chat(user), "text": "bench"},
+        }}
+
+    async def _step(self, name: str, payload: dict) -> None:
+        update = Update.de_json(payload, self.app.bot)
+        started = time.perf_counter()
+        await self.app.update_processor.process_update(update, self.app.process_update(update))
+        self.latencies[name].append(time.perf_counter() - started)
+
+    def _reply(self, user: int) -> dict:
+        return self.telegram.last.get(10_000 + user, {})
+
+    def _first_button(self, user: int) -> Optional[str]:
+        markup = self._reply(user).get("markup") or {}
+        rows = markup.get("inline_keyboard") or []
+        return rows[0][0]["callback_data"] if rows and rows[0] else None
+
+    async def flow(self, user: int) -> None:
+        await self._step("add_record", self._message(user, "➕ Додати запис"))
+        model = self._first_button(user)
+        if model is None:
+            self.failed += 1
+            return
+        await self._step("model", self._callback(user, model))
+
+        vin = self.rng.choice(self.vins) if self.vins and self.rng.random() < 0.8 else random_vin(self.rng)
+        await self._step("vin", self._message(user, vin))
+        if self._reply(user).get("text", "").startswith("Схожі VIN"):
+            await self._step("vin_suggestion", self._callback(user, self._first_button(user)))
+
+        await self._step("work", self._message(user, self.rng.choice(WORKS)))
+        await self._step("description", self._message(user, "⏩ Пропустити"))
+        if self._reply(user).get("text", "").startswith("Меню"):
+            self.saved += 1
+        else:
+            self.failed += 1
+
+    async def user(self, user: int, flows: int, think_time: float) -> None:
+        for _ in range(flows):
+            await self.flow(user)
+            if think_time:
+                await asyncio.sleep(self.rng.uniform(0, think_time))
+
+async def wait_replicated(journal, timeout: float) -> bool:
+    """Чекає, поки реплікатор передасть увесь журнал до аркуша"""
+    deadline = time.perf_counter() + timeout
+    while journal.replicated_seq < journal.last_seq():
+        if time.perf_counter() > deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+def report(title: str, latencies: Dict[str, List[float]]) -> None:
+    print(f"\n{title}")
+    print(f"{'крок':<16}{'к-сть':>8}{'p50, мс':>10}{'p99, мс':>10}{'макс, мс':>10}")
+    for name, values in latencies.items():
+        print(f"{name:<16}{len(values):>8}{percentile(values, 50) * 1000:>10.1f}"
+              f"{percentile(values, 99) * 1000:>10.1f}{max(values) * 1000:>10.1f}")
+
+async def run(args: argparse.Namespace) -> None:
+    started = time.perf_counter()
+    import bot
+    import_time = time.perf_counter() - started
+
+    rng = random.Random(args.seed)
+    sheet = FakeSheets(args.sheets_latency, args.sheets_jitter)
+    if args.archived:
+        # Уся історія в старому Sheet1: перший старт один раз переносить її до локальної копії
+        vins = prefill(sheet, bot.LEGACY_SHEET, "2024-01", bot.GoogleSheetsManager.HEADERS, args.rows, rng)
+    else:
+        month = time.strftime("%Y-%m")
+        vins = prefill(sheet, bot.partition_for(f"{month}-01"), month, bot.GoogleSheetsManager.HEADERS, args.rows, rng)
+    telegram = FakeTelegramRequest(args.telegram_latency)
+    sheets = bot.AsyncSheetsManager(bot.GoogleSheetsManager(sheet=sheet))
+    # Фейкові користувачі відповідають миттєво, тож без --telegram-limits ліміти чатів не заважають вимірюванню
+    scheduler = bot.SendScheduler() if args.telegram_limits else bot.SendScheduler(
+        global_rate=1e6, chat_rate=1e6, chat_burst=1e6, group_rate=1e6
+    )
+    app = bot.build_application(request=telegram, sheets=sheets, scheduler=scheduler)
+
+    started = time.perf_counter()
+    await app.initialize()
+    await app.post_init(app)
+    startup = time.perf_counter() - started
+
+    driver = FlowDriver(app, telegram, vins, rng)
+    started = time.perf_counter()
+    await asyncio.gather(*(driver.user(user, args.flows, args.think_time) for user in range(args.users)))
+    elapsed = time.perf_counter() - started
+    replicated = await wait_replicated(sheets.journal, args.drain_timeout)
+    replicated_elapsed = time.perf_counter() - started
+
+    await app.post_shutdown(app)
+    await app.shutdown()
+
+    print(f"Аркуш: {args.rows} рядків, затримка Sheets {args.sheets_latency * 1000:.0f}"
+          f"+{args.sheets_jitter * 1000:.0f} мс, Telegram {args.telegram_latency * 1000:.0f} мс")
+    print(f"Імпорт bot.py: {import_time:.2f} с, старт (індекси з {args.rows} рядків): {startup:.2f} с")
+    report(f"Затримка кроків ({args.users} користувачів × {args.flows} бесід)", driver.latencies)
+    print(f"\nЗбережено {driver.saved} записів за {elapsed:.2f} с: {driver.saved / elapsed:.1f} записів/с"
+          + (f", невдалих бесід: {driver.failed}" if driver.failed else ""))
+    if replicated:
+        print(f"Передано до аркуша за {replicated_elapsed:.2f} с: "
+              f"{driver.saved / replicated_elapsed:.1f} записів/с")
+    else:
+        print(f"Журнал не передано до аркуша за {args.drain_timeout:.0f} с")
+    print(f"Запити Sheets: {dict(sheet.calls)}, прочитано рядків: {sheet.rows_read} "
+          f"(клітинок: {sheet.cells_read}), записано: {sheet.rows_written}")
+    print(f"Запити Bot API: {dict(telegram.calls)}")
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк бота з фейковими Telegram і Google Sheets")
+    parser.add_argument("--users", type=int, default=20, help="кількість одночасних користувачів")
+    parser.add_argument("--flows", type=int, default=5, help="бесід на кожного користувача")
+    parser.add_argument("--rows", type=int, default=10_000, help="рядків в аркуші до початку")
+    parser.add_argument("--sheets-latency", type=float, default=0.15, help="затримка запиту Sheets, сек")
+    parser.add_argument("--sheets-jitter", type=float, default=0.05, help="випадкова добавка до затримки Sheets, сек")
+    parser.add_argument("--telegram-latency", type=float, default=0.03, help="затримка запиту Bot API, сек")
+    parser.add_argument("--telegram-limits", action="store_true", help="застосувати справжні ліміти Telegram на чат")
+    parser.add_argument("--archived", action="store_true", help="покласти історію в архівну вкладку Sheet1")
+    parser.add_argument("--think-time", type=float, default=0.0, help="пауза користувача між бесідами, сек")
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="скільки чекати на передачу журналу, сек")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    configure_environment(args)
+    # Бенчмарк друкує власний звіт; журнал бота лише заважає
+    logging.disable(logging.WARNING)
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,28 +1,66 @@
 import os
 import logging
 import base64
+import bisect
+import hashlib
 import json
-from typing import Dict, List, Optional
+import csv
+import io
+import tempfile
+import math
+import random
+import asyncio
+import functools
+import threading
+import signal
+import socket
+import sqlite3
+import sys
+import time
+from collections import Counter, OrderedDict
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     ReplyKeyboardMarkup,
     ReplyKeyboardRemove,
+    InputFile,
 )
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, MessageHandler,
-    CallbackQueryHandler, ConversationHandler, ContextTypes, filters
+    Application, ApplicationBuilder, CommandHandler, MessageHandler,
+    CallbackQueryHandler, ConversationHandler, ContextTypes, filters,
+    BaseUpdateProcessor, BasePersistence, PersistenceInput, BaseRateLimiter
 )
+from telegram.error import RetryAfter
+from telegram.request import BaseRequest
 import datetime
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+
+# Момент імпорту модуля: від нього рахується час холодного старту
+STARTED_AT = time.monotonic()
 
 # Константи
 MODEL, VIN, WORK, DESCRIPTION = range(4)
+CONVERSATION_NAME = "add_record"
 RECENT_ITEMS_LIMIT = 5
+RECENT_INDEX_SIZE = 50  # Скільки унікальних значень зберігати в індексі для кожного поля
+RECENT_INDEX_FIELDS = ["executor", "model", "vin", "work"]
+TAIL_READ_ROWS = 200  # Скільки останніх рядків читати з аркуша, щоб заповнити індекс останніх значень
+KEYBOARD_CACHE_SIZE = 256  # Скільки готових клавіатур тримати в пам'яті
+CALLBACK_TOKENS_SIZE = 10000  # Скільки токенів callback_data тримати в пам'яті
+CALLBACK_TOKEN_TTL = 24 * 60 * 60  # Скільки секунд кнопка лишається дійсною
+IDEMPOTENCY_CACHE_SIZE = 10000  # Скільки ключів збережених записів тримати в пам'яті
+IDEMPOTENCY_TTL = 24 * 60 * 60  # Скільки секунд повторне збереження тієї ж бесіди повертає старий ID
 MAX_WORK_LENGTH = 64  # Максимальна довжина основного опису роботи в байтах
+HISTORY_LIMIT = 10  # Скільки записів показувати в /history і /mine
+VIN_SUGGESTIONS_LIMIT = 5  # Скільки схожих VIN пропонувати
+WORK_SUGGESTIONS_LIMIT = 6  # Скільки робіт пропонувати на клавіатурі
+WORK_SUGGESTIONS_SIZE = 50  # Скільки робіт тримати в рейтингу для кожної моделі/виконавця
+WORK_HALF_LIFE_DAYS = 30  # За скільки днів вага запису в рейтингу зменшується вдвічі
+EXPORT_SUMMARY_LIMIT = 15  # Скільки рядків показувати в кожному розділі підсумків
+WORK_EXECUTOR_WEIGHT = 2.0  # Наскільки історія самого виконавця важливіша за загальну по моделі
 
 # Списки моделей
 TESLA_MODELS = ["Model 3", "Model Y", "Model S", "Model X", "Cybertruck", "Roadster", "Інше (не Tesla)"]
@@ -37,11 +75,68 @@ SPECIAL_COMMANDS = [
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 GOOGLE_SHEETS_CREDENTIALS_BASE64 = os.getenv("GOOGLE_SHEETS_CREDENTIALS_BASE64")
 GOOGLE_SHEETS_SPREADSHEET_ID = os.getenv("GOOGLE_SHEETS_SPREADSHEET_ID")
+BOT_MODE = os.getenv("BOT_MODE", "polling")  # polling, webhook, worker (оновлення від router) або router
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Публічна адреса, на яку Telegram надсилатиме оновлення
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN")  # Перевіряється в заголовку X-Telegram-Bot-Api-Secret-Token
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))  # Скільки оновлень може чекати на обробку або оброблятися
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "16"))  # Скільки оновлень обробляються одночасно
+PERSISTENCE_PATH = os.getenv("PERSISTENCE_PATH", "state.db")  # Стани бесід і user_data
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "30"))  # Як часто зберігати стани, сек
+USERS_FILE = os.getenv("USERS_FILE")  # Необов'язковий файл зі списками OWNERS/MANAGERS/WORKERS
+USERS_RELOAD_INTERVAL = 30  # Як часто перевіряти зміни файлу користувачів, сек
+SHEETS_MAX_WORKERS = int(os.getenv("SHEETS_MAX_WORKERS", "4"))  # Кількість одночасних запитів до Google Sheets
+SHEETS_CALL_TIMEOUT = float(os.getenv("SHEETS_CALL_TIMEOUT", "15"))  # Таймаут одного запиту в секундах
+REPLICA_SYNC_INTERVAL = float(os.getenv("REPLICA_SYNC_INTERVAL", "60"))  # Як часто дочитувати нові рядки аркуша, сек
+REPLICA_BLOCK_ROWS = 500  # Розмір блоку рядків, який звіряється з аркушем за один раз
+ID_COUNTER_FILE = os.getenv("ID_COUNTER_FILE", "last_id.txt")
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "50"))  # Максимум рядків в одному запиті append
+WRITE_BATCH_INTERVAL_MS = int(os.getenv("WRITE_BATCH_INTERVAL_MS", "500"))  # Скільки чекати на інші рядки перед записом
+WRITE_RETRY_BASE_DELAY = 1.0
+WRITE_RETRY_MAX_DELAY = 60.0
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+SHEETS_READS_PER_MINUTE = float(os.getenv("SHEETS_READS_PER_MINUTE", "60"))  # Квота читання Sheets API на користувача
+SHEETS_WRITES_PER_MINUTE = float(os.getenv("SHEETS_WRITES_PER_MINUTE", "60"))  # Квота запису Sheets API на користувача
+SHEETS_BURST = 10  # Скільки запитів можна виконати підряд без очікування
+SHEETS_MAX_RETRIES = 4  # Повтори одного запиту при 429/5xx
+SHEETS_RETRY_BASE_DELAY = 0.5
+SHEETS_RETRY_MAX_DELAY = 16.0
+SHEETS_BREAKER_THRESHOLD = 5  # Після скількох помилок поспіль припинити звертання до Sheets
+SHEETS_BREAKER_COOLDOWN = 60.0  # На скільки секунд
+WRITE_DRAIN_TIMEOUT = 30.0  # Скільки чекати на передачу журналу під час зупинки
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "records.db")
+SHEET_PARTITIONS = os.getenv("SHEET_PARTITIONS", "monthly")  # monthly - вкладка на кожен місяць, none - усе в Sheet1
+HOT_PARTITIONS = int(os.getenv("HOT_PARTITIONS", "2"))  # Скільки останніх місяців синхронізуються з аркушем постійно
+LEGACY_SHEET = "Sheet1"  # Вкладка, куди записи потрапляли до розбиття за місяцями
+SQLITE_BUSY_TIMEOUT = 30.0  # Скільки чекати на блокування SQLite, яке тримає інший процес, сек
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH")  # Спільний для воркерів SQLite: лічильник ID і оренда ролі записувача
+WORKER_NAME = os.getenv("WORKER_NAME", f"{socket.gethostname()}-{os.getpid()}")
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "15"))  # Скільки триває оренда ролі записувача без поновлення, сек
+FOLLOW_INTERVAL = float(os.getenv("FOLLOW_INTERVAL", "2"))  # Як часто воркер дочитує записи інших воркерів, сек
+WORKER_URLS = [url.strip().rstrip("/") for url in os.getenv("WORKER_URLS", "").split(",") if url.strip()]  # Для router
+ROUTER_FORWARD_TIMEOUT = 10.0  # Таймаут пересилання оновлення воркеру, сек
+MAX_UPDATE_BYTES = 1 << 20  # Найбільше тіло HTTP-запиту з оновленням
+STARTUP_BUDGET = float(os.getenv("STARTUP_BUDGET", "5"))  # Допустимий час від імпорту до готовності приймати оновлення, сек
+SUMMARY_TIME = os.getenv("SUMMARY_TIME", "20:00")  # Коли надсилати підсумки власникам і керівникам (HH:MM), порожнє - ніколи
+SUMMARY_WEEKDAY = int(os.getenv("SUMMARY_WEEKDAY", "6"))  # День тижневих підсумків: 0 - понеділок, 6 - неділя
+STATS_RETENTION_DAYS = 14  # За скільки останніх днів тримати лічильники підсумків
+STATS_CHECKPOINT_INTERVAL = 60  # Як часто зберігати лічильники підсумків, сек
+SEND_GLOBAL_RATE = 30.0  # Ліміт Telegram: повідомлень за секунду від бота загалом
+SEND_CHAT_RATE = 1.0  # Повідомлень за секунду в один приватний чат
+SEND_CHAT_BURST = 3  # Скільки запитів в один чат можна надіслати підряд без очікування
+SEND_GROUP_RATE = 20 / 60  # Повідомлень за секунду в одну групу
+SEND_MAX_RETRIES = 3  # Скільки разів повторювати запит після RetryAfter
+SEND_BUCKETS_SIZE = 512  # Після скількох відер чатів прибирати ті, що вже повністю наповнилися
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))  # 0 вимикає HTTP-ендпоінт /metrics
 
-def parse_user_list(env_var: str) -> dict:
+def parse_user_list(env_var: str, source: Optional[Dict[str, str]] = None) -> dict:
     """Парсить список користувачів у форматі { '@username': 'Ім'я Прізвище' }"""
     users = {}
-    for item in os.getenv(env_var, "").split(","):
+    raw = os.getenv(env_var, "") if source is None else source.get(env_var, "")
+    for item in raw.split(","):
         if not item.strip():
             continue
         parts = item.strip().split(" ", 1)
@@ -51,10 +146,63 @@ def parse_user_list(env_var: str) -> dict:
             users[username] = name
     return users
 
+class UserDirectory:
+    """Довідник користувачів: нормалізований username -> (рівень доступу, ім'я)"""
+    
+    # Порядок важливий: вищий рівень перекриває нижчий для того самого username
+    LEVELS = (("worker", "WORKERS"), ("manager", "MANAGERS"), ("owner", "OWNERS"))
+    
+    def __init__(self, path: Optional[str] = USERS_FILE):
+        self.path = path
+        self._mtime: Optional[float] = None
+        self.version = 0
+        self.reload()
+    
+    def _read_source(self) -> Dict[str, str]:
+        """Читає списки зі змінних оточення; файл USERS_FILE (рядки KEY=value) має пріоритет"""
+        source = {key: os.getenv(key, "") for _, key in self.LEVELS}
+        if self.path and os.path.exists(self.path):
+            self._mtime = os.path.getmtime(self.path)
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line.startswith("#") or "=" not in line:
+                        continue
+                    key, value = line.split("=", 1)
+                    if key.strip() in source:
+                        source[key.strip()] = value.strip()
+        return source
+    
+    def reload(self) -> None:
+        """Перебудовує індекс; нові дані підміняються одним присвоєнням"""
+        source = self._read_source()
+        lists = {key: parse_user_list(key, source) for _, key in self.LEVELS}
+        index = {}
+        for level, key in self.LEVELS:
+            for username, name in lists[key].items():
+                index[username.lower()] = (level, name)
+        self.owners, self.managers, self.workers = lists["OWNERS"], lists["MANAGERS"], lists["WORKERS"]
+        self._index = index
+        self.version += 1
+    
+    def maybe_reload(self) -> bool:
+        """Перезавантажує довідник, якщо файл користувачів змінився"""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        if os.path.getmtime(self.path) == self._mtime:
+            return False
+        self.reload()
+        return True
+    
+    def lookup(self, username: str) -> Optional[Tuple[str, str]]:
+        """Повертає (рівень, ім'я) або None"""
+        username = username.strip().lower()
+        if not username.startswith("@"):
+            username = f"@{username}"
+        return self._index.get(username)
+
 # Рівні доступу
-OWNERS = parse_user_list("OWNERS")
-MANAGERS = parse_user_list("MANAGERS")
-WORKERS = parse_user_list("WORKERS")
+users = UserDirectory()
 
 # Налаштування логування
 logging.basicConfig(
@@ -63,6 +211,146 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class Metrics:
+    """Реєстр лічильників, показників і гістограм, що віддаються в текстовому форматі Prometheus"""
+    
+    # Межі кошиків гістограм затримок, сек
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    
+    def __init__(self):
+        self._counters: Dict[tuple, float] = {}
+        self._gauges: Dict[tuple, float] = {}
+        self._histograms: Dict[tuple, list] = {}
+        self._callbacks: Dict[tuple, object] = {}
+    
+    @staticmethod
+    def _key(name: str, labels: Dict[str, str]) -> tuple:
+        return (name, tuple(sorted(labels.items())))
+    
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = self._key(name, labels)
+        self._counters[key] = self._counters.get(key, 0.0) + value
+    
+    def set(self, name: str, value: float, **labels) -> None:
+        self._gauges[self._key(name, labels)] = value
+    
+    def set_function(self, name: str, func, **labels) -> None:
+        """Показник, значення якого обчислюється в момент віддачі метрик"""
+        self._callbacks[self._key(name, labels)] = func
+    
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = self._key(name, labels)
+        # [лічильники по кошиках..., сума, кількість]
+        series = self._histograms.get(key)
+        if series is None:
+            series = self._histograms[key] = [0] * len(self.BUCKETS) + [0.0, 0]
+        index = bisect.bisect_left(self.BUCKETS, value)
+        if index < len(self.BUCKETS):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+    
+    @staticmethod
+    def _format(name: str, labels: tuple, value: float) -> str:
+        if labels:
+            label_text = ",".join(f'{key}="{val}"' for key, val in labels)
+            return f"{name}{{{label_text}}} {value:g}"
+        return f"{name} {value:g}"
+    
+    def render(self) -> str:
+        gauges = dict(self._gauges)
+        for key, func in self._callbacks.items():
+            try:
+                gauges[key] = float(func())
+            except Exception as error:
+                logger.error(f"Не вдалося обчислити метрику {key[0]}: {error}")
+        lines = []
+        for kind, series in (("counter", self._counters), ("gauge", gauges)):
+            typed = set()
+            for (name, labels), value in sorted(series.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} {kind}")
+                    typed.add(name)
+                lines.append(self._format(name, labels, value))
+        typed = set()
+        for (name, labels), values in sorted(self._histograms.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS, values):
+                cumulative += count
+                lines.append(self._format(f"{name}_bucket", labels + (("le", f"{bound:g}"),), cumulative))
+            lines.append(self._format(f"{name}_bucket", labels + (("le", "+Inf"),), values[-1]))
+            lines.append(self._format(f"{name}_sum", labels, values[-2]))
+            lines.append(self._format(f"{name}_count", labels, values[-1]))
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+def timed(handler):
+    """Записує тривалість обробника в гістограму handler_latency_seconds"""
+    name = handler.__name__
+    
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await handler(update, context)
+        finally:
+            metrics.observe("handler_latency_seconds", time.perf_counter() - started, handler=name)
+    return wrapper
+
+def funnel(step: str) -> None:
+    """Рахує перехід бесіди до наступного кроку: model → vin → work → description → saved/abandoned"""
+    metrics.inc("conversation_funnel_total", step=step)
+
+async def read_http_request(reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes]:
+    """Читає HTTP-запит: метод, шлях без query, заголовки (ключі в нижньому регістрі) і тіло"""
+    request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+    headers = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), timeout=5)
+        if not line.strip():
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_UPDATE_BYTES:
+        raise ValueError(f"Занадто велике тіло запиту: {length} байт")
+    body = await asyncio.wait_for(reader.readexactly(length), timeout=5) if length else b""
+    parts = request_line.decode("latin-1").split()
+    if len(parts) < 2:
+        raise ValueError("Некоректний рядок запиту")
+    return parts[0], parts[1].split("?")[0], headers, body
+
+def http_server(handler):
+    """Мінімальний HTTP-сервер для asyncio.start_server: handler(method, path, headers, body) -> (status, body)"""
+    async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            try:
+                method, path, headers, body = await read_http_request(reader)
+            except ValueError:
+                status, payload = "400 Bad Request", b"bad request\n"
+            else:
+                status, payload = await handler(method, path, headers, body)
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    return serve
+
+async def metrics_endpoint(method: str, path: str, headers: Dict[str, str], body: bytes) -> Tuple[str, bytes]:
+    """GET /metrics віддає метрики, решта - 404"""
+    if method == "GET" and path == "/metrics":
+        return "200 OK", metrics.render().encode()
+    return "404 Not Found", b"not found\n"
+
 # Клавіатури
 OWNER_MENU = ReplyKeyboardMarkup(
     [["➕ Додати запис"]],
@@ -84,10 +372,75 @@ DESCRIPTION_MARKUP = ReplyKeyboardMarkup(
     resize_keyboard=True
 )
 
+def column_letter(number: int) -> str:
+    """Перетворює номер стовпця (з 1) на літеру A1-нотації"""
+    letters = ""
+    while number:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+def tail_window(row_count: int, window: int = TAIL_READ_ROWS) -> tuple:
+    """Номери першого і останнього з window останніх рядків вкладки (рядок 1 - заголовок)"""
+    return max(2, row_count - window + 1), row_count
+
+def payload_cells(value) -> int:
+    """Кількість клітинок у відповіді чи аргументах запиту Sheets: рядки й стовпці рахуються за довжиною"""
+    if isinstance(value, dict):
+        return sum(payload_cells(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        if value and isinstance(value[0], (list, tuple, dict)):
+            return sum(payload_cells(item) for item in value)
+        return len(value)
+    return 0 if value is None else 1
+
+def partition_for(timestamp: str) -> str:
+    """Вкладка, до якої потрапляє запис із часом timestamp ("YYYY-MM-DD HH:MM:SS")"""
+    if SHEET_PARTITIONS == "none":
+        return LEGACY_SHEET
+    return timestamp[:7]
+
+def partition_period(name: str) -> Optional[str]:
+    """Місяць "YYYY-MM", записи якого лежать у вкладці; None для Sheet1 та інших вкладок"""
+    if len(name) == 7 and name[4] == "-" and name[:4].isdigit() and name[5:].isdigit():
+        return name
+    return None
+
+def hot_periods(now: Optional[datetime.datetime] = None, count: int = HOT_PARTITIONS) -> List[str]:
+    """Останні count місяців, починаючи з поточного"""
+    now = now or datetime.datetime.now()
+    year, month = now.year, now.month
+    periods = []
+    for _ in range(count):
+        periods.append(f"{year:04d}-{month:02d}")
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return periods
+
 class GoogleSheetsManager:
     HEADERS = ["id", "timestamp", "user", "user_name", "executor", "executor_name", "model", "vin", "work", "description", "user_level"]
     
-    def __init__(self):
+    def __init__(self, sheet=None):
+        # sheet дозволяє підставити власний клієнт spreadsheets() (бенчмарки, інструменти)
+        self._sheet = sheet
+        self.credentials = None
+        self._connect_lock = threading.Lock()
+        self._local = threading.local()
+    
+    @property
+    def sheet(self):
+        """Клієнт spreadsheets(); створюється під час першого запиту, а не під час імпорту"""
+        if self._sheet is None:
+            with self._connect_lock:
+                if self._sheet is None:
+                    self._sheet = self._connect()
+        return self._sheet
+    
+    def _connect(self):
+        """Декодує облікові дані і будує клієнт Sheets API"""
+        # Важкі імпорти відкладені до першого звернення до Sheets
+        from google.oauth2.service_account import Credentials
+        from googleapiclient.discovery import build
+        
         # Декодуємо облікові дані з base64
         creds_json = base64.b64decode(GOOGLE_SHEETS_CREDENTIALS_BASE64).decode('utf-8')
         creds_dict = json.loads(creds_json)
@@ -98,130 +451,2063 @@ class GoogleSheetsManager:
             scopes=['https://www.googleapis.com/auth/spreadsheets']
         )
         
-        # Ініціалізуємо API
-        self.service = build('sheets', 'v4', credentials=self.credentials)
-        self.sheet = self.service.spreadsheets()
+        # Документ discovery береться з копії, що постачається з бібліотекою, без запиту до мережі
+        service = build('sheets', 'v4', credentials=self.credentials, static_discovery=True, cache_discovery=False)
+        return service.spreadsheets()
+    
+    def _http(self):
+        """Повертає HTTP-клієнт поточного потоку (httplib2 не є потокобезпечним)"""
+        if self.credentials is None:
+            # Підставлений клієнт сам відповідає за транспорт
+            return None
+        http = getattr(self._local, "http", None)
+        if http is None:
+            from google_auth_httplib2 import AuthorizedHttp
+            import httplib2
+            http = AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=SHEETS_CALL_TIMEOUT))
+            self._local.http = http
+        return http
     
     def _get_sheet_data(self, range_name: str) -> List[List]:
-        """Отримує дані з аркуша"""
-        try:
-            result = self.sheet.values().get(
-                spreadsheetId=GOOGLE_SHEETS_SPREADSHEET_ID,
-                range=range_name
-            ).execute()
-            return result.get('values', [])
-        except HttpError as error:
-            logger.error(f"Помилка при отриманні даних з Google Sheets: {error}")
-            return []
+        """Отримує дані з аркуша; HttpError передається викликачу для повтору"""
+        result = self.sheet.values().get(
+            spreadsheetId=GOOGLE_SHEETS_SPREADSHEET_ID,
+            range=range_name
+        ).execute(http=self._http())
+        return result.get('values', [])
+    
+    def _append_to_sheet(self, range_name: str, values: List[List]) -> None:
+        """Додає дані до аркуша; HttpError передається викликачу для повтору"""
+        self.sheet.values().append(
+            spreadsheetId=GOOGLE_SHEETS_SPREADSHEET_ID,
+            range=range_name,
+            valueInputOption="USER_ENTERED",
+            body={'values': values}
+        ).execute(http=self._http())
+    
+    def get_rows(self, tab: str, start_row: int, end_row: Optional[int] = None) -> List[List]:
+        """Отримує рядки вкладки з start_row до end_row включно (до кінця, якщо end_row не задано)"""
+        last_column = column_letter(len(self.HEADERS))
+        end = end_row if end_row is not None else ""
+        return self._get_sheet_data(f"'{tab}'!A{start_row}:{last_column}{end}")
+    
+    def column_range(self, tab: str, field: str, start_row: int = 2, end_row: Optional[int] = None) -> str:
+        """Діапазон A1 стовпця поля з HEADERS у рядках з start_row до end_row (до кінця, якщо не задано)"""
+        letter = column_letter(self.HEADERS.index(field) + 1)
+        end = end_row if end_row is not None else ""
+        return f"'{tab}'!{letter}{start_row}:{letter}{end}"
+    
+    def _batch_get_columns(self, ranges: List[str]) -> List[List[str]]:
+        """Читає кілька одностовпцевих діапазонів одним запитом; HttpError передається викликачу для повтору"""
+        result = self.sheet.values().batchGet(
+            spreadsheetId=GOOGLE_SHEETS_SPREADSHEET_ID,
+            ranges=ranges,
+            majorDimension="COLUMNS"
+        ).execute(http=self._http())
+        return [(value_range.get("values") or [[]])[0] for value_range in result.get("valueRanges", [])]
+    
+    def get_columns(self, tab: str, fields: List[str], start_row: int = 2, end_row: Optional[int] = None) -> Dict[str, List[str]]:
+        """Отримує лише стовпці полів fields (порожні клітинки в кінці стовпця не повертаються)"""
+        ranges = [self.column_range(tab, field, start_row, end_row) for field in fields]
+        return dict(zip(fields, self._batch_get_columns(ranges)))
+    
+    def get_tail(self, tab: str, row_count: int, fields: List[str], window: int = TAIL_READ_ROWS) -> Dict[str, List[str]]:
+        """Стовпці полів з останніх window рядків вкладки, в якій row_count рядків разом із заголовком"""
+        start_row, end_row = tail_window(row_count, window)
+        if start_row > end_row:
+            return {field: [] for field in fields}
+        return self.get_columns(tab, fields, start_row, end_row)
+    
+    def grid_rows(self) -> Dict[str, int]:
+        """Кількість рядків сітки кожної вкладки (разом із порожніми рядками під даними)"""
+        result = self.sheet.get(
+            spreadsheetId=GOOGLE_SHEETS_SPREADSHEET_ID,
+            fields="sheets.properties(title,gridProperties.rowCount)"
+        ).execute(http=self._http())
+        return {
+            sheet["properties"]["title"]: sheet["properties"].get("gridProperties", {}).get("rowCount", 0)
+            for sheet in result.get("sheets", [])
+        }
+    
+    def write_headers(self, tab: str) -> None:
+        """Додає заголовки до порожньої вкладки"""
+        self._append_to_sheet(f"'{tab}'", [self.HEADERS])
+    
+    def list_tabs(self) -> List[str]:
+        """Повертає назви всіх вкладок таблиці"""
+        result = self.sheet.get(
+            spreadsheetId=GOOGLE_SHEETS_SPREADSHEET_ID,
+            fields="sheets.properties.title"
+        ).execute(http=self._http())
+        return [sheet["properties"]["title"] for sheet in result.get("sheets", [])]
+    
+    def create_tab(self, tab: str) -> None:
+        """Створює вкладку із заголовками HEADERS"""
+        self.sheet.batchUpdate(
+            spreadsheetId=GOOGLE_SHEETS_SPREADSHEET_ID,
+            body={"requests": [{"addSheet": {"properties": {"title": tab}}}]}
+        ).execute(http=self._http())
+        self.write_headers(tab)
+    
+    def build_row(self, record_id: int, user_data: Dict[str, str], username: str, user_name: str, user_level: str) -> List[str]:
+        """Формує рядок запису в порядку HEADERS"""
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return [
+            str(record_id),
+            timestamp,
+            username,
+            user_name,
+            user_data["executor"],
+            user_data["executor_name"],
+            user_data["model"],
+            user_data["vin"],
+            user_data["work"],
+            user_data.get("description", ""),
+            user_level
+        ]
+    
+    def append_rows(self, rows: List[List], tab: str = LEGACY_SHEET) -> None:
+        """Додає пачку рядків до вкладки одним запитом; HttpError передається викликачу для повтору"""
+        self.sheet.values().append(
+            spreadsheetId=GOOGLE_SHEETS_SPREADSHEET_ID,
+            range=f"'{tab}'",
+            valueInputOption="USER_ENTERED",
+            insertDataOption="INSERT_ROWS",
+            body={'values': rows}
+        ).execute(http=self._http())
+
+class IdAllocator:
+    """Видає унікальні ID записів; останній виданий ID зберігається в локальному файлі"""
+    
+    def __init__(self, path: str = ID_COUNTER_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._last = self._read()
     
-    def _append_to_sheet(self, range_name: str, values: List[List]) -> bool:
-        """Додає дані до аркуша"""
+    def _read(self) -> int:
         try:
-            body = {'values': values}
-            result = self.sheet.values().append(
-                spreadsheetId=GOOGLE_SHEETS_SPREADSHEET_ID,
-                range=range_name,
-                valueInputOption="USER_ENTERED",
-                body=body
-            ).execute()
+            with open(self.path, encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+    
+    def _persist(self) -> None:
+        """Атомарно записує лічильник на диск"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(self._last))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+    
+    def reconcile(self, sheet_last_id: int) -> None:
+        """Узгоджує лічильник з останнім ID в аркуші (викликається при старті)"""
+        with self._lock:
+            if sheet_last_id > self._last:
+                self._last = sheet_last_id
+                self._persist()
+    
+    def next_id(self) -> int:
+        with self._lock:
+            self._last += 1
+            self._persist()
+            return self._last
+
+class SharedStore:
+    """Сховище, спільне для кількох процесів бота (SQLite): лічильники і оренди ролей"""
+    
+    def __init__(self, path: str = SHARED_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+    
+    def _transaction(self, func):
+        """Виконує func(conn) в одній транзакції з блокуванням на запис (BEGIN IMMEDIATE)"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+    
+    def increment(self, name: str) -> int:
+        """Атомарно збільшує лічильник на 1 і повертає нове значення"""
+        def step(conn):
+            conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)", (name,))
+            conn.execute("UPDATE counters SET value = value + 1 WHERE name = ?", (name,))
+            return conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()[0]
+        return self._transaction(step)
+    
+    def raise_to(self, name: str, value: int) -> None:
+        """Піднімає лічильник до value, якщо він менший"""
+        self._transaction(lambda conn: conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = MAX(value, excluded.value)", (name, value)
+        ))
+    
+    def try_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Бере або поновлює оренду; повертає False, якщо нею володіє інший живий процес"""
+        def step(conn):
+            now = time.time()
+            row = conn.execute("SELECT owner, expires FROM leases WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                return False
+            conn.execute("INSERT OR REPLACE INTO leases (name, owner, expires) VALUES (?, ?, ?)", (name, owner, now + ttl))
             return True
-        except HttpError as error:
-            logger.error(f"Помилка при додаванні даних до Google Sheets: {error}")
-            return False
+        return self._transaction(step)
     
-    def get_recent_values(self, field: str, limit: int = RECENT_ITEMS_LIMIT) -> List[str]:
-        """Отримує останні значення для певного поля"""
+    def release(self, name: str, owner: str) -> None:
+        self._transaction(lambda conn: conn.execute(
+            "DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner)
+        ))
+    
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+class SharedIdAllocator:
+    """Видає унікальні ID записів з лічильника в SharedStore (той самий інтерфейс, що й IdAllocator)"""
+    
+    def __init__(self, store: SharedStore, name: str = "record_id"):
+        self.store = store
+        self.name = name
+    
+    def reconcile(self, sheet_last_id: int) -> None:
+        self.store.raise_to(self.name, sheet_last_id)
+    
+    def next_id(self) -> int:
+        return self.store.increment(self.name)
+
+class RecordJournal:
+    """Локальний журнал записів (SQLite у режимі WAL); кожен запис спершу потрапляє сюди.
+    
+    seq - порядковий номер вставки, що зростає в порядку фіксації транзакцій навіть тоді, коли
+    журнал спільний для кількох процесів і ID виділяються не в тому порядку, в якому записуються.
+    """
+    
+    def __init__(self, path: str = JOURNAL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        # Воркери зі спільним журналом стартують одночасно: схему перевіряє і оновлює лише один з них
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS records "
+                "(id INTEGER PRIMARY KEY, row TEXT NOT NULL, seq INTEGER, idempotency_key TEXT)"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            columns = {column[1] for column in self._conn.execute("PRAGMA table_info(records)")}
+            if "seq" not in columns:
+                # Журнал старішої версії: порядок вставки збігався з порядком ID
+                self._conn.execute("ALTER TABLE records ADD COLUMN seq INTEGER")
+                self._conn.execute("UPDATE records SET seq = id")
+            if "idempotency_key" not in columns:
+                self._conn.execute("ALTER TABLE records ADD COLUMN idempotency_key TEXT")
+            self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS records_seq ON records (seq)")
+            self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS records_idempotency_key ON records (idempotency_key)")
+    
+    def append(self, record_id: int, row: List[str], key: Optional[str] = None) -> int:
+        """Додає запис; якщо запис з ключем key уже є (зокрема від іншого воркера), повертає його ID"""
+        with self._lock:
+            # Запит на вставку бере блокування на запис до читання MAX(seq), тож seq не повторюються
+            cursor = self._conn.execute(
+                "INSERT INTO records (id, row, seq, idempotency_key) "
+                "VALUES (?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM records), ?) "
+                "ON CONFLICT (idempotency_key) DO NOTHING",
+                (record_id, json.dumps(row, ensure_ascii=False), key)
+            )
+            if cursor.rowcount:
+                return record_id
+            return self._conn.execute("SELECT id FROM records WHERE idempotency_key = ?", (key,)).fetchone()[0]
+    
+    def find(self, key: str) -> Optional[int]:
+        """ID запису, збереженого з ключем ідемпотентності key"""
+        with self._lock:
+            row = self._conn.execute("SELECT id FROM records WHERE idempotency_key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    
+    def last_id(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM records").fetchone()[0]
+    
+    def last_seq(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM records").fetchone()[0]
+    
+    def pending(self, after_seq: int, limit: int) -> List[tuple]:
+        """Повертає (seq, рядок) записів після after_seq у порядку вставки"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, row FROM records WHERE seq > ? ORDER BY seq LIMIT ?", (after_seq, limit)
+            ).fetchall()
+        return [(seq, json.loads(row)) for seq, row in rows]
+    
+    def get_meta(self, key: str, default: str = "") -> str:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+    
+    def set_meta(self, key: str, value: str) -> None:
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+    
+    @property
+    def replicated_seq(self) -> int:
+        """Найбільший seq, уже переданий до Google Sheets"""
+        return int(self.get_meta("replicated_seq", self.get_meta("replicated_id", "0")))
+    
+    @replicated_seq.setter
+    def replicated_seq(self, value: int) -> None:
+        self.set_meta("replicated_seq", str(value))
+    
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+class IdempotencyCache:
+    """Ключі ідемпотентності нещодавно збережених записів і їхні ID; витісняються за TTL і розміром"""
+    
+    def __init__(self, max_size: int = IDEMPOTENCY_CACHE_SIZE, ttl: float = IDEMPOTENCY_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+    
+    def get(self, key: str) -> Optional[int]:
+        self._evict()
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+    
+    def add(self, key: str, record_id: int) -> None:
+        self._entries[key] = (record_id, time.monotonic())
+        self._entries.move_to_end(key)
+        self._evict()
+    
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        now = time.monotonic()
+        while self._entries:
+            _, created = next(iter(self._entries.values()))
+            if now - created < self.ttl:
+                break
+            self._entries.popitem(last=False)
+
+class LeaseLostError(Exception):
+    """Воркер більше не володіє орендою ролі записувача"""
+
+class SheetsUnavailableError(Exception):
+    """Google Sheets тимчасово недоступний (розімкнено запобіжник)"""
+
+def is_retryable_error(error: Exception) -> bool:
+    """Чи варто повторити запит до Google Sheets після цієї помилки"""
+    from googleapiclient.errors import HttpError
+    import httplib2
+    
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUSES
+    return isinstance(error, (asyncio.TimeoutError, OSError, httplib2.HttpLib2Error, SheetsUnavailableError))
+
+class TokenBucket:
+    """Асинхронне відро токенів: у середньому rate запитів за секунду, сплеск до capacity"""
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self) -> float:
+        """Чекає на вільний токен; повертає час очікування в секундах"""
+        waited = 0.0
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+    
+    def is_full(self) -> bool:
+        """Чи відро вже наповнилося, тобто його можна прибрати без зміни поведінки"""
+        return self._tokens + (time.monotonic() - self._updated) * self.rate >= self.capacity and not self._lock.locked()
+
+class CircuitBreaker:
+    """Запобіжник: після threshold помилок поспіль перестає звертатися до Sheets на cooldown секунд"""
+    
+    CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+    
+    def __init__(self, threshold: int = SHEETS_BREAKER_THRESHOLD, cooldown: float = SHEETS_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+    
+    def _set_state(self, state: int) -> None:
+        if state != self.state:
+            logger.warning(f"Запобіжник Google Sheets: {('закритий', 'розімкнений', 'пробний')[state]}")
+        self.state = state
+        metrics.set("sheets_breaker_state", state)
+    
+    def allow(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            # Після паузи пропускаємо пробні запити
+            self._set_state(self.HALF_OPEN)
+        return True
+    
+    def record_success(self) -> None:
+        self._failures = 0
+        self._set_state(self.CLOSED)
+    
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self.state == self.HALF_OPEN or self._failures >= self.threshold:
+            self._opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+class SheetReplica:
+    """Локальна копія вкладок аркуша у SQLite; рядки зберігаються за вкладкою і номером рядка"""
+    
+    def __init__(self, path: str = JOURNAL_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS replica_rows (tab TEXT NOT NULL, row_num INTEGER NOT NULL, "
+            "record_id INTEGER, data TEXT NOT NULL, PRIMARY KEY (tab, row_num))"
+        )
+        legacy = self._conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sheet_rows'"
+        ).fetchone()
+        if legacy:
+            # Копія старішої версії зберігала лише Sheet1
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO replica_rows (tab, row_num, record_id, data) "
+                    "SELECT ?, row_num, record_id, data FROM sheet_rows", (LEGACY_SHEET,)
+                )
+                self._conn.execute("DROP TABLE sheet_rows")
+        self._verify_blocks: Dict[str, int] = {}
+    
+    def row_count(self, tab: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COALESCE(MAX(row_num), 0) FROM replica_rows WHERE tab = ?", (tab,)
+            ).fetchone()[0]
+    
+    def last_id(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(record_id), 0) FROM replica_rows").fetchone()[0]
+    
+    def rows(self, tab: str, start_row: int = 1, end_row: int = -1) -> List[List]:
+        """Повертає рядки вкладки з start_row до end_row включно (-1 - до кінця)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM replica_rows WHERE tab = ? AND row_num >= ? AND (? < 0 OR row_num <= ?) "
+                "ORDER BY row_num",
+                (tab, start_row, end_row, end_row)
+            ).fetchall()
+        return [json.loads(data) for data, in rows]
+    
+    @staticmethod
+    def _record_id(row: List[str]) -> Optional[int]:
+        return int(row[0]) if row and row[0].strip().isdigit() else None
+    
+    def store(self, tab: str, start_row: int, rows: List[List], truncate: bool = False) -> None:
+        """Записує рядки вкладки, починаючи з start_row; truncate видаляє все, що лежить далі"""
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            if truncate:
+                self._conn.execute("DELETE FROM replica_rows WHERE tab = ? AND row_num >= ?", (tab, start_row))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO replica_rows (tab, row_num, record_id, data) VALUES (?, ?, ?, ?)",
+                [(tab, start_row + i, self._record_id(row), json.dumps(row, ensure_ascii=False))
+                 for i, row in enumerate(rows)]
+            )
+    
+    @staticmethod
+    def checksum(rows: List[List]) -> str:
+        digest = hashlib.sha1()
+        for row in rows:
+            digest.update(json.dumps(row, ensure_ascii=False).encode("utf-8"))
+            digest.update(b"\n")
+        return digest.hexdigest()
+    
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+    
+    def next_block(self, tab: str, block_rows: int = REPLICA_BLOCK_ROWS) -> Tuple[int, int]:
+        """Повертає наступний (start_row, end_row) вкладки для звірки; блоки обходяться по колу"""
+        total = self.row_count(tab)
+        block = self._verify_blocks.get(tab, 0)
+        start = block * block_rows + 1
+        if start > total:
+            block = 0
+            start = 1
+        self._verify_blocks[tab] = block + 1
+        return start, start + block_rows - 1
+
+class PartitionCatalog:
+    """Каталог вкладок-розділів: назва вкладки і місяць, записи якого вона містить"""
+    
+    def __init__(self, path: str = JOURNAL_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS partitions (name TEXT PRIMARY KEY, period TEXT)")
+    
+    def add(self, name: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO partitions (name, period) VALUES (?, ?)", (name, partition_period(name))
+            )
+    
+    def names(self) -> List[str]:
+        """Усі відомі вкладки від найстаріших до найновіших (Sheet1 - першою)"""
+        with self._lock:
+            rows = self._conn.execute("SELECT name FROM partitions ORDER BY period IS NOT NULL, period").fetchall()
+        return [name for name, in rows]
+    
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM partitions WHERE name = ?", (name,)).fetchone() is not None
+    
+    def hot(self) -> List[str]:
+        """Вкладки, які постійно синхронізуються з аркушем: останні місяці, або Sheet1 без розбиття"""
+        if SHEET_PARTITIONS == "none":
+            return [LEGACY_SHEET]
+        periods = set(hot_periods())
+        return [name for name in self.names() if partition_period(name) in periods]
+    
+    def covering(self, date_from: Optional[str], date_to: Optional[str]) -> List[str]:
+        """Вкладки, місяці яких перетинаються з періодом дат "YYYY-MM-DD" (межі необов'язкові)"""
+        names = []
+        for name in self.names():
+            period = partition_period(name)
+            if period is None:
+                # Про вміст Sheet1 за датами нічого не відомо
+                names.append(name)
+            elif (not date_from or period >= date_from[:7]) and (not date_to or period <= date_to[:7]):
+                names.append(name)
+        return names
+    
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+class RecordStats:
+    """Щоденні лічильники записів (усього, за виконавцями, за моделями) для підсумків.
+    
+    Лічильники оновлюються рядками журналу в порядку seq і періодично зберігаються в SQLite
+    разом з останнім урахованим seq, тож після перезапуску з журналу дочитуються лише новіші рядки.
+    """
+    
+    KINDS = ("total", "executor", "model")
+    
+    def __init__(self, path: str = JOURNAL_PATH, retention_days: int = STATS_RETENTION_DAYS):
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS daily_stats "
+            "(day TEXT NOT NULL, kind TEXT NOT NULL, key TEXT NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (day, kind, key))"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS stats_checkpoint (id INTEGER PRIMARY KEY CHECK (id = 1), seq INTEGER NOT NULL)")
+        self._days: Dict[str, Dict[str, Counter]] = {}
+        row = self._conn.execute("SELECT seq FROM stats_checkpoint").fetchone()
+        self.seq = row[0] if row else 0
+        for day, kind, key, count in self._conn.execute("SELECT day, kind, key, count FROM daily_stats"):
+            self._day(day)[kind][key] = count
+        self._dirty = False
+    
+    def _day(self, day: str) -> Dict[str, Counter]:
+        counters = self._days.get(day)
+        if counters is None:
+            counters = self._days[day] = {kind: Counter() for kind in self.KINDS}
+        return counters
+    
+    def catch_up(self, journal: RecordJournal) -> None:
+        """Додає до лічильників рядки журналу, збережені після останнього урахованого"""
+        fresh = journal.pending(self.seq, -1)
+        if not fresh:
+            return
+        for seq, row in fresh:
+            record = dict(zip(GoogleSheetsManager.HEADERS, row))
+            counters = self._day(record["timestamp"][:10])
+            counters["total"][""] += 1
+            counters["executor"][record["executor_name"] or record["executor"]] += 1
+            counters["model"][record["model"]] += 1
+        self.seq = fresh[-1][0]
+        oldest = (datetime.date.today() - datetime.timedelta(days=self.retention_days)).isoformat()
+        for day in [day for day in self._days if day < oldest]:
+            del self._days[day]
+        self._dirty = True
+    
+    def totals(self, date_from: str, date_to: str) -> Dict[str, Counter]:
+        """Сумарні лічильники за дні з date_from до date_to включно (формат YYYY-MM-DD)"""
+        totals = {kind: Counter() for kind in self.KINDS}
+        for day, counters in self._days.items():
+            if date_from <= day <= date_to:
+                for kind in self.KINDS:
+                    totals[kind].update(counters[kind])
+        return totals
+    
+    def checkpoint(self) -> None:
+        """Зберігає лічильники, якщо жоден інший воркер ще не зберіг новіших"""
+        if not self._dirty:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT seq FROM stats_checkpoint").fetchone()
+                if not row or row[0] < self.seq:
+                    self._conn.execute("DELETE FROM daily_stats")
+                    self._conn.executemany(
+                        "INSERT INTO daily_stats (day, kind, key, count) VALUES (?, ?, ?, ?)",
+                        [(day, kind, key, count) for day, counters in self._days.items()
+                         for kind in self.KINDS for key, count in counters[kind].items()]
+                    )
+                    self._conn.execute("INSERT OR REPLACE INTO stats_checkpoint (id, seq) VALUES (1, ?)", (self.seq,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._dirty = False
+    
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+class ChatDirectory:
+    """Запам'ятовує чат кожного користувача, щоб бот міг сам написати йому (підсумки за розкладом)"""
+    
+    def __init__(self, path: str = JOURNAL_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS chats (username TEXT PRIMARY KEY, chat_id INTEGER NOT NULL)")
+        self._known: Dict[str, int] = {}
+    
+    def is_known(self, username: str, chat_id: int) -> bool:
+        """Чи вже збережено саме цей чат користувача (без звернення до SQLite)"""
+        return self._known.get(username.lower()) == chat_id
+    
+    def remember(self, username: str, chat_id: int) -> None:
+        username = username.lower()
+        if self._known.get(username) == chat_id:
+            return
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO chats (username, chat_id) VALUES (?, ?)", (username, chat_id))
+        self._known[username] = chat_id
+    
+    def get(self, username: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute("SELECT chat_id FROM chats WHERE username = ?", (username.lower(),)).fetchone()
+        return row[0] if row else None
+    
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+class RecordReplicator:
+    """Фоново передає журнал до Google Sheets пачками в порядку ID і веде позначку переданого"""
+    
+    def __init__(self, journal: RecordJournal, append, local, batch_size: int = WRITE_BATCH_SIZE,
+                 interval: float = WRITE_BATCH_INTERVAL_MS / 1000):
+        self.journal = journal
+        # append(rows) -> скільки перших рядків пачки записано до аркуша
+        self._append = append
+        # local(func, *args) виконує звернення до журналу в потоці стану, а не в циклі подій
+        self._local = local
+        self.batch_size = batch_size
+        self.interval = interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+    
+    def notify(self) -> None:
+        """Повідомляє про нові записи в журналі"""
+        self._wakeup.set()
+    
+    async def _flush(self, batch: List[tuple]) -> None:
+        """Додає пачку (або її початок) до аркуша, повторюючи з експоненційною затримкою до успіху"""
+        rows = [row for _, row in batch]
+        attempt = 0
+        while True:
+            try:
+                written = await self._append(rows)
+                break
+            except LeaseLostError:
+                raise
+            except Exception as error:
+                delay = min(WRITE_RETRY_MAX_DELAY, WRITE_RETRY_BASE_DELAY * 2 ** attempt)
+                attempt += 1
+                if is_retryable_error(error):
+                    logger.warning(f"Помилка запису до Google Sheets ({error}), повтор через {delay:.1f} с")
+                else:
+                    logger.error(f"Не вдалося записати записи #{rows[0][0]}-#{rows[-1][0]} до Google Sheets: {error}")
+                await asyncio.sleep(delay)
+        await self._local(self._mark_replicated, batch[written - 1][0])
+    
+    def _next_batch(self) -> List[tuple]:
+        return self.journal.pending(self.journal.replicated_seq, self.batch_size)
+    
+    def _mark_replicated(self, seq: int) -> None:
+        self.journal.replicated_seq = seq
+        metrics.set("journal_backlog_records", self.journal.last_seq() - seq)
+    
+    async def replicate_pending(self) -> None:
+        """Передає всі записи журналу після позначки"""
+        while True:
+            batch = await self._local(self._next_batch)
+            if not batch:
+                return
+            await self._flush(batch)
+    
+    async def _loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Даємо час іншим записам потрапити в ту саму пачку
+            await asyncio.sleep(self.interval)
+            self._wakeup.clear()
+            try:
+                await self.replicate_pending()
+            except LeaseLostError:
+                # Журнал передає новий записувач; цей воркер запустить реплікатор знову, якщо поверне роль
+                self._task = None
+                return
+    
+    async def stop(self) -> None:
+        """Зупиняє фонову передачу; непередане лишається в журналі"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def drain(self, timeout: float = WRITE_DRAIN_TIMEOUT) -> None:
+        """Намагається передати залишок журналу і зупиняє реплікатор; непередане лишається в журналі"""
+        await self.stop()
         try:
-            data = self._get_sheet_data("Sheet1")
-            if not data:
-                return []
-            
-            # Знаходимо індекс стовпця
+            await asyncio.wait_for(self.replicate_pending(), timeout)
+        except LeaseLostError:
+            pass
+        except asyncio.TimeoutError:
+            logger.warning("Не всі записи передано до Google Sheets; їх буде передано після перезапуску")
+
+class RecentValuesIndex:
+    """Індекс останніх унікальних значень для кожного поля (від найновішого до найстарішого)"""
+    
+    def __init__(self, fields: List[str], size: int = RECENT_INDEX_SIZE):
+        self.fields = fields
+        self.size = size
+        self._values: Dict[str, OrderedDict] = {field: OrderedDict() for field in fields}
+        self.version = 0
+    
+    def load(self, data: List[List]) -> None:
+        """Перебудовує індекс з рядків аркуша (перший рядок - заголовок)"""
+        values = {field: OrderedDict() for field in self.fields}
+        if data:
             header = data[0]
-            try:
-                col_index = header.index(field)
-            except ValueError:
-                return []
-            
-            # Збираємо унікальні значення
-            values = []
-            seen = set()
-            for row in reversed(data[1:]):
-                if len(values) >= limit:
-                    break
-                if len(row) > col_index:
-                    val = row[col_index].strip()
-                    if val and val not in seen:
-                        seen.add(val)
-                        values.append(val)
-            return values
-        except Exception as e:
-            logger.error(f"Помилка при отриманні останніх значень: {e}")
+            columns = [(field, header.index(field)) for field in self.fields if field in header]
+            for field, col_index in columns:
+                bucket = values[field]
+                # Йдемо з кінця, доки не наберемо достатньо унікальних значень
+                for row in reversed(data[1:]):
+                    if len(bucket) >= self.size:
+                        break
+                    if len(row) > col_index:
+                        val = row[col_index].strip()
+                        if val and val not in bucket:
+                            bucket[val] = None
+                # Зберігаємо порядок від найстарішого до найновішого
+                values[field] = OrderedDict((val, None) for val in reversed(bucket))
+        self._values = values
+        self.version += 1
+    
+    def add_older(self, columns: Dict[str, List[str]]) -> None:
+        """Доповнює індекс старішими за наявні значеннями (стовпці - від найстарішого до найновішого)"""
+        for field, column in columns.items():
+            if field not in self._values:
+                continue
+            merged = OrderedDict()
+            for val in [val.strip() for val in column] + list(self._values[field]):
+                if val:
+                    merged.pop(val, None)
+                    merged[val] = None
+            while len(merged) > self.size:
+                merged.popitem(last=False)
+            self._values[field] = merged
+        self.version += 1
+    
+    def add(self, record: Dict[str, str]) -> None:
+        """Оновлює індекс новим записом"""
+        for field, bucket in self._values.items():
+            val = (record.get(field) or "").strip()
+            if not val:
+                continue
+            bucket.pop(val, None)
+            bucket[val] = None
+            if len(bucket) > self.size:
+                bucket.popitem(last=False)
+        self.version += 1
+    
+    def get(self, field: str, limit: int = RECENT_ITEMS_LIMIT) -> List[str]:
+        """Повертає до limit останніх унікальних значень поля"""
+        bucket = self._values.get(field)
+        if not bucket:
             return []
+        return list(islice(reversed(bucket), limit))
+
+class VinSuggester:
+    """Підказки VIN: відсортований список для пошуку за префіксом і індекс замін для схожих VIN.
+    
+    Типові помилки у 6 символах - один неправильний символ або два переставлені сусідні.
+    Для першого кожен VIN індексується 6 шаблонами з "*" на одній позиції, для другого
+    перевіряються 5 перестановок введеного тексту, тож запит коштує ~11 звернень до словника.
+    """
+    
+    def __init__(self):
+        self._sorted: List[str] = []
+        self._patterns: Dict[str, List[str]] = {}
+    
+    def __len__(self) -> int:
+        return len(self._sorted)
+    
+    def __contains__(self, vin: str) -> bool:
+        pos = bisect.bisect_left(self._sorted, vin)
+        return pos < len(self._sorted) and self._sorted[pos] == vin
+    
+    @staticmethod
+    def _wildcards(vin: str):
+        for i in range(len(vin)):
+            yield f"{vin[:i]}*{vin[i + 1:]}"
+    
+    def add(self, vin: str) -> None:
+        if vin in self:
+            return
+        bisect.insort(self._sorted, vin)
+        for pattern in self._wildcards(vin):
+            self._patterns.setdefault(pattern, []).append(vin)
     
-    def save_record(self, user_data: Dict[str, str], username: str, user_name: str, user_level: str) -> int:
-        """Зберігає запис у Google Sheets"""
+    def by_prefix(self, prefix: str, limit: int = VIN_SUGGESTIONS_LIMIT) -> List[str]:
+        pos = bisect.bisect_left(self._sorted, prefix)
+        result = []
+        while pos < len(self._sorted) and len(result) < limit and self._sorted[pos].startswith(prefix):
+            result.append(self._sorted[pos])
+            pos += 1
+        return result
+    
+    def similar(self, vin: str) -> List[Tuple[int, str]]:
+        """Повертає (кількість помилок, VIN) для відомих VIN, що відрізняються на одну заміну або перестановку"""
+        found = {}
+        if vin in self:
+            found[vin] = 0
+        for pattern in self._wildcards(vin):
+            for candidate in self._patterns.get(pattern, ()):
+                found.setdefault(candidate, 1)
+        for i in range(len(vin) - 1):
+            swapped = f"{vin[:i]}{vin[i + 1]}{vin[i]}{vin[i + 2:]}"
+            if swapped != vin and swapped in self:
+                found.setdefault(swapped, 1)
+        return [(dist, candidate) for candidate, dist in found.items()]
+
+class WorkSuggester:
+    """Рейтинг робіт за частотою з експоненційним згасанням, окремо для кожної моделі та виконавця.
+    
+    Внесок запису дорівнює exp((t - t0) / tau): множник згасання однаковий для всіх значень,
+    тому порівнювати накопичені суми можна без перерахунку на кожному кроці.
+    """
+    
+    def __init__(self, half_life_days: float = WORK_HALF_LIFE_DAYS, size: int = WORK_SUGGESTIONS_SIZE):
+        self.tau = half_life_days * 86400 / math.log(2)
+        self.size = size
+        self._origin = time.time()
+        self._scores: Dict[tuple, Dict[str, float]] = {}
+    
+    def _weight(self, timestamp: float) -> float:
+        exponent = (timestamp - self._origin) / self.tau
+        if exponent > 500:
+            # Переносимо точку відліку, щоб уникнути переповнення
+            shift = math.exp(-exponent)
+            for scores in self._scores.values():
+                for work in scores:
+                    scores[work] *= shift
+            self._origin = timestamp
+            exponent = 0.0
+        return math.exp(exponent)
+    
+    def _bump(self, key: tuple, work: str, weight: float) -> None:
+        scores = self._scores.setdefault(key, {})
+        if work in scores or len(scores) < self.size:
+            scores[work] = scores.get(work, 0.0) + weight
+            return
+        # Таблиця повна: нова робота заміщає найслабшу і успадковує її рахунок (Space-Saving),
+        # інакше її єдиний внесок завжди був би мінімальним і вона ніколи б не потрапила до рейтингу
+        weakest = min(scores, key=scores.get)
+        scores[work] = scores.pop(weakest) + weight
+    
+    def add(self, model: str, executor: str, work: str, timestamp: float) -> None:
+        if not work:
+            return
+        weight = self._weight(timestamp)
+        self._bump((), work, weight)
+        if model:
+            self._bump((model,), work, weight)
+            if executor:
+                self._bump((model, executor.lower()), work, weight)
+    
+    def rank(self, model: str, executor: str = "", limit: int = 6) -> List[str]:
+        """Найімовірніші роботи для моделі (з урахуванням виконавця), доповнені загальним рейтингом"""
+        combined: Dict[str, float] = dict(self._scores.get((model,), {}))
+        for work, score in self._scores.get((model, executor.lower()), {}).items():
+            combined[work] = combined.get(work, 0.0) + WORK_EXECUTOR_WEIGHT * score
+        result = sorted(combined, key=combined.get, reverse=True)[:limit]
+        if len(result) < limit:
+            overall = self._scores.get((), {})
+            for work in sorted(overall, key=overall.get, reverse=True):
+                if len(result) >= limit:
+                    break
+                if work not in combined:
+                    result.append(work)
+        return result
+
+def parse_timestamp(value: str) -> float:
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp()
+    except ValueError:
+        return time.time()
+
+class RecordIndex:
+    """Інвертований індекс записів: VIN і виконавець -> зміщення рядків у пам'яті"""
+    
+    # Поля автора запису стоять наприкінці, щоб не зсувати позиції, за якими працюють індекси
+    FIELDS = ("id", "timestamp", "executor", "executor_name", "model", "vin", "work", "description",
+              "user", "user_name", "user_level")
+    # Значення, що часто повторюються, інтернуються, щоб не тримати тисячі однакових рядків
+    INTERNED = {"executor", "executor_name", "model", "vin", "work", "user", "user_name", "user_level"}
+    
+    def __init__(self):
+        self._rows: List[tuple] = []
+        self._by_id: Dict[int, int] = {}
+        self._by_vin: Dict[str, List[int]] = {}
+        self._by_executor: Dict[str, List[int]] = {}
+        self.vins = VinSuggester()
+        self.works = WorkSuggester()
+        self.version = 0
+    
+    def _positions(self, header: List[str]) -> List[Optional[int]]:
+        return [header.index(field) if field in header else None for field in self.FIELDS]
+    
+    def _add(self, row: List[str], positions: List[Optional[int]]) -> bool:
+        values = []
+        for field, pos in zip(self.FIELDS, positions):
+            val = row[pos].strip() if pos is not None and pos < len(row) else ""
+            values.append(sys.intern(val) if field in self.INTERNED else val)
+        if not values[0].isdigit():
+            return False
+        record_id = int(values[0])
+        if record_id in self._by_id:
+            return False
+        offset = len(self._rows)
+        self._rows.append(tuple(values))
+        self._by_id[record_id] = offset
+        if values[5]:
+            vin = values[5].upper()
+            offsets = self._by_vin.get(vin)
+            if offsets is None:
+                offsets = self._by_vin[vin] = []
+                self.vins.add(vin)
+            offsets.append(offset)
+        if values[2]:
+            self._by_executor.setdefault(values[2].lower(), []).append(offset)
+        self.works.add(values[4], values[2], values[6], parse_timestamp(values[1]))
+        self.version += 1
+        return True
+    
+    def add_rows(self, header: List[str], rows: List[List]) -> List[List]:
+        """Індексує рядки з заданим заголовком; повертає ті, яких ще не було в індексі"""
+        positions = self._positions(header)
+        return [row for row in rows if self._add(row, positions)]
+    
+    def add(self, row: List[str]) -> bool:
+        """Індексує рядок у форматі HEADERS (новий запис або запис з журналу)"""
+        return self._add(row, self._positions(GoogleSheetsManager.HEADERS))
+    
+    def _records(self, offsets: List[int], limit: int) -> List[Dict[str, str]]:
+        return [dict(zip(self.FIELDS, self._rows[offset])) for offset in reversed(offsets[-limit:])]
+    
+    def by_vin(self, vin: str, limit: int = HISTORY_LIMIT) -> List[Dict[str, str]]:
+        """Останні записи за VIN, від найновішого"""
+        return self._records(self._by_vin.get(vin.strip().upper(), []), limit)
+    
+    def by_executor(self, executor: str, limit: int = HISTORY_LIMIT) -> List[Dict[str, str]]:
+        """Останні записи виконавця, від найновішого"""
+        return self._records(self._by_executor.get(executor.strip().lower(), []), limit)
+    
+    def count_vin(self, vin: str) -> int:
+        return len(self._by_vin.get(vin.strip().upper(), []))
+    
+    def count_executor(self, executor: str) -> int:
+        return len(self._by_executor.get(executor.strip().lower(), []))
+    
+    def iter_records(self, date_from: str, date_to: str, executor: Optional[str] = None):
+        """Послідовно віддає записи з датою в межах [date_from, date_to] (формат YYYY-MM-DD)"""
+        if executor:
+            executor = executor.strip().lower()
+            offsets = self._by_executor.get(executor if executor.startswith("@") else f"@{executor}")
+            if offsets is None:
+                # Дозволяємо фільтрувати й за ім'ям виконавця
+                offsets = [offset for offset, row in enumerate(self._rows) if row[3].lower() == executor]
+        else:
+            offsets = range(len(self._rows))
+        for offset in offsets:
+            row = self._rows[offset]
+            if date_from <= row[1][:10] <= date_to:
+                yield row
+    
+    def suggest_vins(self, text: str, limit: int = VIN_SUGGESTIONS_LIMIT) -> List[str]:
+        """Найближчі відомі VIN до введеного тексту; частіші авто - вище"""
+        text = text.strip().upper()
+        if len(text) < 6:
+            candidates = [(0, vin) for vin in self.vins.by_prefix(text, limit * 4)]
+        else:
+            candidates = self.vins.similar(text)
+        candidates.sort(key=lambda item: (item[0], -len(self._by_vin.get(item[1], ())), item[1]))
+        return [vin for _, vin in candidates[:limit]]
+
+class AsyncSheetsManager:
+    """Асинхронна обгортка над GoogleSheetsManager, що виконує запити в обмеженому пулі потоків"""
+    
+    def __init__(self, manager: GoogleSheetsManager, max_workers: int = SHEETS_MAX_WORKERS,
+                 timeout: float = SHEETS_CALL_TIMEOUT, store: Optional[SharedStore] = None):
+        self.manager = manager
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sheets")
+        # Окремий потік для локального і спільного SQLite: очікування блокування не зупиняє цикл подій
+        self._state_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state")
+        self.recent = RecentValuesIndex(RECENT_INDEX_FIELDS)
+        self.history = RecordIndex()
+        # Зі спільним сховищем кілька воркерів ділять журнал і лічильник ID, а до Sheets пише лише обраний записувач
+        self.store = store
+        self.is_leader = store is None
+        self.ids = SharedIdAllocator(store) if store else IdAllocator()
+        self.journal = RecordJournal()
+        self.replica = SheetReplica()
+        self.catalog = PartitionCatalog()
+        self.stats = RecordStats()
+        self.chats = ChatDirectory()
+        self._buckets = {
+            "read": TokenBucket(SHEETS_READS_PER_MINUTE / 60, SHEETS_BURST),
+            "write": TokenBucket(SHEETS_WRITES_PER_MINUTE / 60, SHEETS_BURST),
+        }
+        self.breaker = CircuitBreaker()
+        self.replicator = RecordReplicator(self.journal, self._append_records, self._local)
+        self._initial_sync: Optional[asyncio.Task] = None
+        # Що вже потрапило до індексів: seq журналу, кількість рядків вкладок і покоління локальної копії
+        self._journal_seq = 0
+        self._replica_rows: Dict[str, int] = {}
+        self._replica_generation = ""
+        self._verify_turn = 0
+        # Рядки архівних вкладок, завантажених на вимогу (див. load_partitions): лише в пам'яті до перезапуску
+        self._loaded_archives: Dict[str, List[List]] = {}
+        self.submitted = IdempotencyCache()
+        # Чи могла попередня спроба append дійти до аркуша, хоча й завершилася помилкою
+        self._append_uncertain = False
+        # Запити, які перевищили таймаут, але все ще виконуються в пулі потоків
+        self._in_flight: set = set()
+    
+    async def _run(self, func, *args):
+        """Виконує блокуючий виклик у пулі потоків з таймаутом"""
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, functools.partial(func, *args))
         try:
-            # Отримуємо всі дані для визначення наступного ID
-            data = self._get_sheet_data("Sheet1")
-            if not data:
-                # Якщо аркуш порожній, додаємо заголовки
-                self._append_to_sheet("Sheet1", [self.HEADERS])
-                next_id = 1
-            else:
-                next_id = int(data[-1][0]) + 1 if len(data) > 1 else 1
-            
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            new_row = [
-                str(next_id),
-                timestamp,
-                username,
-                user_name,
-                user_data["executor"],
-                user_data["executor_name"],
-                user_data["model"],
-                user_data["vin"],
-                user_data["work"],
-                user_data.get("description", ""),
-                user_level
-            ]
-            
-            if self._append_to_sheet("Sheet1", [new_row]):
-                return next_id
-            return 0
-        except Exception as e:
-            logger.error(f"Помилка при збереженні запису: {e}")
-            return 0
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            # Потік пулу не перервати: запит ще виконується і може дійти до аркуша пізніше
+            self._in_flight.add(future)
+            future.add_done_callback(self._forget_in_flight)
+            raise
+    
+    def _forget_in_flight(self, future: asyncio.Future) -> None:
+        self._in_flight.discard(future)
+        if not future.cancelled():
+            # Позначаємо помилку як оброблену: після таймауту її вже ніхто не чекає
+            future.exception()
+    
+    async def _local(self, func, *args):
+        """Виконує звернення до SQLite (журнал, спільний стан) у потоці стану"""
+        return await asyncio.get_running_loop().run_in_executor(self._state_executor, functools.partial(func, *args))
+    
+    async def _call(self, op: str, func, *args, retries: int = SHEETS_MAX_RETRIES):
+        """Виконує запит до Sheets з урахуванням квот, повторами при 429/5xx і запобіжником"""
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                metrics.inc("sheets_requests_total", op=op, outcome="rejected")
+                raise SheetsUnavailableError("Google Sheets тимчасово недоступний")
+            waited = await self._buckets[op].acquire()
+            if waited:
+                metrics.inc("sheets_throttle_seconds_total", waited, op=op)
+            method = func.__name__
+            started = time.perf_counter()
+            try:
+                result = await self._run(func, *args)
+            except Exception as error:
+                metrics.observe("sheets_request_seconds", time.perf_counter() - started, op=op, method=method)
+                if not is_retryable_error(error):
+                    metrics.inc("sheets_requests_total", op=op, outcome="error")
+                    raise
+                self.breaker.record_failure()
+                metrics.inc("sheets_requests_total", op=op, outcome="retryable_error")
+                if attempt >= retries:
+                    raise
+                # Повна випадкова затримка, щоб одночасні повтори не збігалися в часі
+                delay = random.uniform(0, min(SHEETS_RETRY_MAX_DELAY, SHEETS_RETRY_BASE_DELAY * 2 ** attempt))
+                attempt += 1
+                metrics.inc("sheets_retries_total", op=op)
+                await asyncio.sleep(delay)
+                continue
+            metrics.observe("sheets_request_seconds", time.perf_counter() - started, op=op, method=method)
+            self.breaker.record_success()
+            metrics.inc("sheets_requests_total", op=op, outcome="ok")
+            # Розмір корисного навантаження в клітинках: без серіалізації всієї відповіді в циклі подій
+            # Для записів рахуються лише передані рядки, а не назва вкладки чи інші аргументи
+            payload = result if op == "read" else [arg for arg in args if isinstance(arg, list)]
+            metrics.inc("sheets_payload_cells_total", payload_cells(payload), op=op, method=method)
+            return result
+    
+    def _prepare(self) -> bool:
+        """Готує локальний стан до старту (у потоці стану); повертає, чи є в журналі непередані записи"""
+        if LEGACY_SHEET not in self.catalog and self.replica.row_count(LEGACY_SHEET):
+            # Локальна копія з версії до розбиття за місяцями: її рядки перенесено у вкладку Sheet1
+            self.catalog.add(LEGACY_SHEET)
+        self.stats.catch_up(self.journal)
+        backlog = self.journal.last_seq() - self.journal.replicated_seq
+        metrics.set("journal_backlog_records", backlog)
+        return backlog > 0
+    
+    def _reconcile_ids(self) -> None:
+        self.ids.reconcile(max(self.journal.last_id(), self.replica.last_id()))
+    
+    async def start(self) -> None:
+        """Будує індекси з локальної копії аркуша, дочитує нові рядки і запускає реплікатор"""
+        if await self._local(self._prepare):
+            # Процес міг зупинитися між append і збереженням replicated_seq: спершу перевіряємо хвіст аркуша
+            self._append_uncertain = True
+        await self._rebuild_indexes()
+        if self.store is not None:
+            await self.elect()
+        if not self.is_leader:
+            return
+        if await self._local(self.catalog.names):
+            # Локальна копія вже є: нові рядки аркуша дочитуються у фоні, не затримуючи старт
+            self._initial_sync = asyncio.create_task(self._refresh_replica())
+        else:
+            await self.discover_partitions()
+            await self._import_legacy()
+            await self.sync_replica()
+            await self._seed_from_archive()
+        await self._local(self._reconcile_ids)
+        self.replicator.start()
+        # Передаємо записи, що не потрапили до аркуша до перезапуску
+        self.replicator.notify()
+    
+    async def elect(self) -> None:
+        """Бере або поновлює оренду ролі записувача; лише записувач звертається до Google Sheets"""
+        # Не через пул Sheets: повільні запити до аркуша не повинні затримувати поновлення оренди
+        leader = await self._local(self.store.try_lease, "writer", WORKER_NAME, LEADER_LEASE_TTL)
+        if leader and not self.is_leader:
+            logger.info(f"Воркер {WORKER_NAME} став записувачем")
+            self.is_leader = True
+            # Попередній записувач міг додати пачку до аркуша і не встигнути зберегти replicated_seq
+            self._append_uncertain = True
+            self.replicator.start()
+            self.replicator.notify()
+        elif not leader and self.is_leader:
+            logger.warning(f"Воркер {WORKER_NAME} втратив роль записувача")
+            self.is_leader = False
+            await self.replicator.stop()
+        metrics.set("writer_leader", int(self.is_leader))
+    
+    def _read_changes(self, generation: str, known_rows: Dict[str, int], journal_seq: int) -> tuple:
+        """Нові рядки локальної копії і журналу після вже проіндексованих (у потоці стану)"""
+        current = self.journal.get_meta("replica_generation")
+        if current != generation:
+            return current, {}, []
+        tabs = {}
+        for tab in self.catalog.names():
+            known = known_rows.get(tab, 0)
+            if self.replica.row_count(tab) > known:
+                header = self._header(tab) if known else None
+                tabs[tab] = (header, self.replica.rows(tab, known + 1), known + 1)
+        fresh = self.journal.pending(journal_seq, -1)
+        if fresh:
+            self.stats.catch_up(self.journal)
+        return current, tabs, fresh
+    
+    async def follow(self) -> None:
+        """Дочитує зміни інших воркерів: нові записи спільного журналу і рядки локальної копії аркуша"""
+        generation, tabs, fresh = await self._local(
+            self._read_changes, self._replica_generation, dict(self._replica_rows), self._journal_seq
+        )
+        if generation != self._replica_generation:
+            # Записувач переписав частину локальної копії після ручних змін в аркуші
+            await self._rebuild_indexes()
+            return
+        for tab, (header, rows, start_row) in tabs.items():
+            self._index_tab(header, rows, start_row)
+            self._replica_rows[tab] = start_row + len(rows) - 1
+        if fresh:
+            self._journal_seq = fresh[-1][0]
+            self._index_rows(GoogleSheetsManager.HEADERS, [row for _, row in fresh])
+            if self.is_leader:
+                self.replicator.notify()
+    
+    def _header(self, tab: str) -> List[str]:
+        header = self.replica.rows(tab, 1, 1)
+        return header[0] if header else GoogleSheetsManager.HEADERS
+    
+    def _index_rows(self, header: List[str], rows: List[List]) -> None:
+        """Додає рядки до індексів; рядки, що вже є в індексі (за ID), пропускаються"""
+        for row in self.history.add_rows(header, rows):
+            self.recent.add(dict(zip(header, row)))
+    
+    def _index_tab(self, header: Optional[List[str]], rows: List[List], start_row: int) -> None:
+        """Індексує рядки вкладки, прочитані з start_row (з першого рядка - разом із заголовком, інакше за header)"""
+        if start_row == 1:
+            if rows:
+                self._index_rows(rows[0], rows[1:])
+        else:
+            self._index_rows(header, rows)
+    
+    def _read_state(self) -> tuple:
+        """Усе, з чого перебудовуються індекси: покоління копії, seq журналу, рядки вкладок і непередані записи"""
+        tabs = {tab: self.replica.rows(tab) for tab in self.catalog.names()}
+        pending = [row for _, row in self.journal.pending(self.journal.replicated_seq, -1)]
+        return self.journal.get_meta("replica_generation"), self.journal.last_seq(), tabs, pending
+    
+    async def _rebuild_indexes(self) -> None:
+        """Повністю перебудовує індекси з локальної копії та журналу (без звернень до мережі)"""
+        self._replica_generation, self._journal_seq, tabs, pending = await self._local(self._read_state)
+        history = RecordIndex()
+        history.version = self.history.version + 1
+        self.history = history
+        # Вкладки мають однакові заголовки, тож для індексу останніх значень їх можна склеїти
+        data = [GoogleSheetsManager.HEADERS]
+        self._replica_rows = {}
+        for tab, rows in tabs.items():
+            self._replica_rows[tab] = len(rows)
+            # Завантажені на вимогу архіви не зникають з індексу після перебудови
+            rows = rows or self._loaded_archives.get(tab, [])
+            if rows:
+                self.history.add_rows(rows[0], rows[1:])
+                data.extend(rows[1:])
+        self.recent.load(data)
+        self._index_rows(GoogleSheetsManager.HEADERS, pending)
+    
+    async def discover_partitions(self) -> None:
+        """Додає до каталогу вкладки-розділи, що вже є в таблиці (створені раніше або іншою копією бота)"""
+        try:
+            tabs = await self._call("read", self.manager.list_tabs)
+        except Exception as error:
+            logger.error(f"Не вдалося отримати список вкладок Google Sheets: {error}")
+            return
+        for tab in tabs:
+            if tab == LEGACY_SHEET or partition_period(tab):
+                await self._local(self.catalog.add, tab)
+    
+    async def _refresh_replica(self) -> None:
+        """Фонова синхронізація після старту: вкладки, створені поза ботом, і нові рядки гарячих вкладок"""
+        await self.discover_partitions()
+        await self._import_legacy()
+        await self.sync_replica()
+    
+    async def _import_legacy(self) -> None:
+        """Один раз переносить до локальної копії Sheet1 - вкладку, де вся історія до розбиття за місяцями.
+        
+        Sheet1 не гаряча і не синхронізується, тож без цього /history, /mine і підказки не знали б
+        жодного запису, зробленого до оновлення.
+        """
+        if not await self._local(self._legacy_unimported):
+            return
+        try:
+            await self._sync_tab(LEGACY_SHEET)
+        except Exception as error:
+            logger.error(f"Не вдалося перенести вкладку {LEGACY_SHEET} до локальної копії: {error}")
+            return
+        logger.info(f"Вкладку {LEGACY_SHEET} перенесено до локальної копії: {self._replica_rows.get(LEGACY_SHEET, 0)} рядків")
+        await self._local(self._reconcile_ids)
+    
+    def _legacy_unimported(self) -> bool:
+        return (LEGACY_SHEET in self.catalog and LEGACY_SHEET not in self.catalog.hot()
+                and not self.replica.row_count(LEGACY_SHEET))
+    
+    async def ensure_partition(self, tab: str) -> None:
+        """Створює вкладку із заголовками, якщо її ще немає в таблиці, і додає її до каталогу"""
+        if tab in await self._local(self.catalog.names):
+            return
+        tabs = await self._call("read", self.manager.list_tabs)
+        if tab not in tabs:
+            logger.info(f"Створюємо вкладку {tab}")
+            await self._call("write", self.manager.create_tab, tab)
+        elif not await self._call("read", self.manager.get_rows, tab, 1, 1):
+            await self._call("write", self.manager.write_headers, tab)
+        await self._local(self.catalog.add, tab)
+    
+    async def _append_records(self, rows: List[List]) -> int:
+        """Додає до аркуша рядки пачки, що належать вкладці першого рядка; повертає їх кількість"""
+        tab = partition_for(rows[0][1])
+        count = 1
+        while count < len(rows) and partition_for(rows[count][1]) == tab:
+            count += 1
+        await self.ensure_partition(tab)
+        batch = rows[:count]
+        if self._append_uncertain:
+            batch = await self._unwritten(tab, batch)
+        if batch:
+            await self._check_lease()
+            # Тайм-аут чи 5xx не означають, що рядки не додано: повторює реплікатор після перевірки хвоста
+            self._append_uncertain = True
+            await self._call("write", self.manager.append_rows, batch, tab, retries=0)
+        self._append_uncertain = False
+        return count
+    
+    async def _check_lease(self) -> None:
+        """Поновлює оренду перед записом до аркуша; якщо її перехопив інший воркер, запис скасовується.
+        
+        Інакше воркер, що завис довше за TTL, після відновлення дописав би пачку, яку вже передає новий записувач.
+        """
+        if self.store is None:
+            return
+        if not await self._local(self.store.try_lease, "writer", WORKER_NAME, LEADER_LEASE_TTL):
+            logger.warning(f"Воркер {WORKER_NAME} втратив роль записувача перед записом до аркуша")
+            self.is_leader = False
+            metrics.set("writer_leader", 0)
+            raise LeaseLostError(WORKER_NAME)
+    
+    async def _unwritten(self, tab: str, rows: List[List]) -> List[List]:
+        """Відкидає рядки, які попередня невдала спроба все ж додала до вкладки (за стовпцем ID хвоста)"""
+        if self._in_flight:
+            # Спершу дочікуємося запиту, що перевищив таймаут, інакше він може додати рядки вже після перевірки
+            await asyncio.wait(list(self._in_flight))
+        # Хвіст локальної копії теж перечитується: фонова синхронізація після старту могла вже забрати ці рядки
+        ids = await self._call("read", self.manager.get_columns, tab, ["id"],
+                               tail_window(await self._local(self.replica.row_count, tab))[0])
+        written = set(ids["id"])
+        if written:
+            logger.info(f"Перевірка хвоста вкладки {tab} після невдалого запису: знайдено {len(written)} ID")
+        return [row for row in rows if str(row[0]) not in written]
+    
+    async def _sync_tab(self, tab: str) -> None:
+        start = await self._local(self.replica.row_count, tab) + 1
+        rows = await self._call("read", self.manager.get_rows, tab, start)
+        if not rows:
+            return
+        await self._local(self.replica.store, tab, start, rows)
+        self._replica_rows[tab] = start + len(rows) - 1
+        self._index_tab(await self._local(self._header, tab) if start > 1 else None, rows, start)
+    
+    async def sync_replica(self) -> None:
+        """Дочитує з гарячих вкладок аркуша лише рядки після останніх відомих"""
+        for tab in await self._local(self.catalog.hot):
+            try:
+                await self._sync_tab(tab)
+            except Exception as error:
+                # Бот і далі працює з локальною копією
+                logger.error(f"Не вдалося синхронізувати локальну копію вкладки {tab}: {error}")
+                return
+        await self._local(self._reconcile_ids)
+    
+    async def _seed_from_archive(self) -> None:
+        """Якщо гарячі вкладки порожні, бере останній ID і останні значення полів з хвоста найновішого архіву.
+        
+        Читаються вікна по TAIL_READ_ROWS рядків від кінця сітки вкладки: порожні рядки під даними API
+        не повертає, тож вікно зсувається вгору, доки не знайдеться останній запис.
+        """
+        if await self._local(self.replica.last_id):
+            return
+        archives = [tab for tab in reversed(await self._local(self.catalog.names))
+                    if not await self._local(self.replica.row_count, tab)]
+        if not archives:
+            return
+        fields = ["id"] + [field for field in self.recent.fields if field != "id"]
+        try:
+            grid = await self._call("read", self.manager.grid_rows)
+            for tab in archives:
+                end_row = grid.get(tab, 0)
+                while end_row >= 2:
+                    tail = await self._call("read", self.manager.get_tail, tab, end_row, fields)
+                    ids = [int(value) for value in tail["id"] if value.isdigit()]
+                    if ids:
+                        await self._local(self.ids.reconcile, max(ids))
+                        self.recent.add_older(tail)
+                        return
+                    end_row = tail_window(end_row)[0] - 1
+        except Exception as error:
+            logger.error(f"Не вдалося прочитати хвіст архівних вкладок: {error}")
+    
+    async def load_partitions(self, date_from: Optional[str], date_to: Optional[str]) -> None:
+        """На вимогу додає до індексу архівні вкладки за період, яких немає в локальній копії.
+        
+        Рядки архіву не зберігаються в локальній копії, тож після перезапуску не індексуються знову;
+        перебудова індексів після ручних змін їх не відкидає.
+        """
+        hot = set(await self._local(self.catalog.hot))
+        for tab in await self._local(self.catalog.covering, date_from, date_to):
+            if tab in hot or tab in self._loaded_archives or await self._local(self.replica.row_count, tab):
+                continue
+            try:
+                rows = await self._call("read", self.manager.get_rows, tab, 1)
+                self._index_tab(None, rows, 1)
+                self._loaded_archives[tab] = rows
+            except Exception as error:
+                logger.error(f"Не вдалося завантажити архівну вкладку {tab}: {error}")
+    
+    async def verify_replica(self) -> None:
+        """Звіряє один блок гарячої вкладки з аркушем і перебудовує індекси, якщо рядки змінили вручну"""
+        hot = [tab for tab in await self._local(self.catalog.hot) if await self._local(self.replica.row_count, tab)]
+        if not hot:
+            return
+        tab = hot[self._verify_turn % len(hot)]
+        self._verify_turn += 1
+        start, end = await self._local(self.replica.next_block, tab)
+        try:
+            remote = await self._call("read", self.manager.get_rows, tab, start, end)
+        except Exception as error:
+            logger.error(f"Не вдалося звірити локальну копію вкладки {tab}: {error}")
+            return
+        local = await self._local(self.replica.rows, tab, start, end)
+        if self.replica.checksum(local) == self.replica.checksum(remote):
+            return
+        logger.info(f"Рядки {start}-{end} вкладки {tab} змінено вручну, оновлюємо локальну копію")
+        # Якщо віддалений блок коротший, рядки в кінці вкладки видалено
+        await self._local(self._replace_block, tab, start, remote, len(remote) < end - start + 1)
+        await self._rebuild_indexes()
+    
+    def _replace_block(self, tab: str, start: int, rows: List[List], truncate: bool) -> None:
+        self.replica.store(tab, start, rows, truncate=truncate)
+        # Інші воркери побачать нове покоління і перебудують свої індекси
+        self.journal.set_meta("replica_generation", str(int(self.journal.get_meta("replica_generation", "0")) + 1))
+    
+    def get_recent_values(self, field: str, limit: int = RECENT_ITEMS_LIMIT) -> List[str]:
+        """Повертає останні значення поля з індексу"""
+        return self.recent.get(field, limit)
+    
+    async def save_record(self, user_data: Dict[str, str], username: str, user_name: str, user_level: str,
+                          key: Optional[str] = None) -> int:
+        """Виділяє ID і записує запис у локальний журнал; до Google Sheets його передає реплікатор.
+        
+        Повторне збереження з тим самим ключем ідемпотентності повертає ID першого запису.
+        """
+        if key:
+            record_id = self.submitted.get(key) or await self._local(self.journal.find, key)
+            if record_id is not None:
+                logger.info(f"Повторне збереження {key}: повертаємо запис #{record_id}")
+                metrics.inc("duplicate_submits_total")
+                self.submitted.add(key, record_id)
+                return record_id
+        record_id = await self._local(self.ids.next_id)
+        row = self.manager.build_row(record_id, user_data, username, user_name, user_level)
+        stored_id = await self._local(self._journal_record, record_id, row, key)
+        if key:
+            self.submitted.add(key, stored_id)
+        if stored_id != record_id:
+            logger.info(f"Повторне збереження {key}: повертаємо запис #{stored_id}")
+            metrics.inc("duplicate_submits_total")
+            return stored_id
+        self.replicator.notify()
+        self.recent.add(user_data)
+        self.history.add(row)
+        return record_id
+    
+    def _journal_record(self, record_id: int, row: List[str], key: Optional[str]) -> int:
+        """Записує рядок до журналу і доводить лічильники підсумків (у потоці стану)"""
+        stored_id = self.journal.append(record_id, row, key)
+        self.stats.catch_up(self.journal)
+        metrics.set("journal_backlog_records", self.journal.last_seq() - self.journal.replicated_seq)
+        return stored_id
+    
+    async def remember_chat(self, username: str, chat_id: int) -> None:
+        """Запам'ятовує чат користувача для підсумків; SQLite - лише коли чат новий або змінився"""
+        if not self.chats.is_known(username, chat_id):
+            await self._local(self.chats.remember, username, chat_id)
+    
+    def _totals(self, date_from: str, date_to: str) -> Dict[str, Counter]:
+        self.stats.catch_up(self.journal)
+        return self.stats.totals(date_from, date_to)
+    
+    async def summary_totals(self, date_from: str, date_to: str) -> Dict[str, Counter]:
+        """Лічильники підсумків за період з урахуванням записів інших воркерів"""
+        return await self._local(self._totals, date_from, date_to)
+    
+    async def summary_chat(self, username: str) -> Optional[int]:
+        return await self._local(self.chats.get, username)
+    
+    async def checkpoint_stats(self) -> None:
+        await self._local(self.stats.checkpoint)
+    
+    async def shutdown(self) -> None:
+        """Передає залишок журналу, дочікується активних запитів і зупиняє пул потоків"""
+        if self._initial_sync is not None and not self._initial_sync.done():
+            self._initial_sync.cancel()
+        if self.is_leader:
+            await self.replicator.drain()
+        self._executor.shutdown(wait=True)
+        await self._local(self._close_state)
+        self._state_executor.shutdown(wait=True)
+    
+    def _close_state(self) -> None:
+        self.stats.checkpoint()
+        self.stats.close()
+        self.chats.close()
+        self.journal.close()
+        self.replica.close()
+        self.catalog.close()
+        if self.store is not None:
+            # Звільняємо роль записувача, щоб інший воркер перейняв її без очікування TTL
+            self.store.release("writer", WORKER_NAME)
+            self.store.close()
+
+# Менеджер Google Sheets створюється в build_application, щоб імпорт модуля не потребував облікових даних
+sheets_manager: Optional[AsyncSheetsManager] = None
+
+class SQLitePersistence(BasePersistence):
+    """Зберігає стани бесід і user_data в SQLite.
+    
+    PTB викликає update_* раз на update_interval лише для змінених ключів; усі зміни одного
+    проходу записуються однією транзакцією. user_data завантажується ліниво, при першому
+    оновленні від користувача, тому старт не залежить від кількості збережених користувачів.
+    Усі звернення до SQLite виконуються по черзі в окремому потоці, а не в циклі подій.
+    """
+    
+    def __init__(self, path: str = PERSISTENCE_PATH, update_interval: float = PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversations "
+            "(name TEXT NOT NULL, key TEXT NOT NULL, state INTEGER NOT NULL, PRIMARY KEY (name, key))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS callback_tokens (data TEXT PRIMARY KEY, payload TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        # Кнопки, старші за TTL, вже не спрацюють, тож їхні токени прибираються при старті
+        self._conn.execute("DELETE FROM callback_tokens WHERE created < ?", (time.time() - CALLBACK_TOKEN_TTL,))
+        self._conn.commit()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persistence")
+        self._loaded_users = set()
+        self._pending: List[tuple] = []
+        self._commit_scheduled = False
+    
+    async def _query(self, sql: str, params: tuple) -> List[tuple]:
+        """Читає в потоці persistence: після всіх змін, переданих йому раніше"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, lambda: self._conn.execute(sql, params).fetchall()
+        )
+    
+    def _stage(self, sql: str, params: tuple) -> None:
+        """Відкладає запис до кінця поточного проходу оновлення persistence"""
+        self._pending.append((sql, params))
+        if not self._commit_scheduled:
+            self._commit_scheduled = True
+            asyncio.get_running_loop().call_soon(self._commit)
+    
+    def _commit(self) -> None:
+        """Передає накопичені зміни потоку persistence; він записує їх у тому ж порядку"""
+        self._commit_scheduled = False
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        self._executor.submit(self._write, pending).add_done_callback(self._log_failure)
+    
+    def _write(self, pending: List[tuple]) -> None:
+        with self._conn:
+            for sql, params in pending:
+                self._conn.execute(sql, params)
+    
+    @staticmethod
+    def _log_failure(future) -> None:
+        if future.exception() is not None:
+            logger.error(f"Не вдалося зберегти стан бесід: {future.exception()}")
+    
+    async def get_conversations(self, name: str) -> Dict:
+        rows = await self._query("SELECT key, state FROM conversations WHERE name = ?", (name,))
+        return {tuple(json.loads(key)): state for key, state in rows}
+    
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        if new_state is None:
+            self._stage("DELETE FROM conversations WHERE name = ? AND key = ?", (name, json.dumps(key)))
+        else:
+            self._stage(
+                "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                (name, json.dumps(key), new_state)
+            )
+    
+    async def get_user_data(self) -> Dict[int, dict]:
+        return {}
+    
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if user_id in self._loaded_users:
+            return
+        self._loaded_users.add(user_id)
+        rows = await self._query("SELECT data FROM user_data WHERE user_id = ?", (user_id,))
+        if rows and not user_data:
+            user_data.update(json.loads(rows[0][0]))
+    
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._loaded_users.add(user_id)
+        self._stage(
+            "INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)",
+            (user_id, json.dumps(data, ensure_ascii=False))
+        )
+    
+    async def drop_user_data(self, user_id: int) -> None:
+        self._loaded_users.discard(user_id)
+        self._stage("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+    
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+    
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+    
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+    
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+    
+    async def get_bot_data(self) -> dict:
+        return {}
+    
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+    
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+    
+    def save_callback_token(self, data: str, payload: object, created: float) -> None:
+        self._stage(
+            "INSERT OR REPLACE INTO callback_tokens (data, payload, created) VALUES (?, ?, ?)",
+            (data, json.dumps(payload, ensure_ascii=False), created)
+        )
+    
+    async def get_callback_token(self, data: str) -> Optional[Tuple[object, float]]:
+        """Значення і час створення токена кнопки; None, якщо його не зберігали"""
+        rows = await self._query("SELECT payload, created FROM callback_tokens WHERE data = ?", (data,))
+        return (json.loads(rows[0][0]), rows[0][1]) if rows else None
+    
+    async def get_callback_data(self) -> None:
+        return None
+    
+    async def update_callback_data(self, data) -> None:
+        pass
+    
+    async def flush(self) -> None:
+        self._commit()
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close)
+        self._executor.shutdown()
+
+class UpdateQueue(asyncio.Queue):
+    """Черга оновлень, що обмежує всі прийняті й ще не оброблені оновлення, а не лише ті, що чекають.
+    
+    З concurrent_updates PTB одразу забирає кожне оновлення з черги в окрему задачу, тож звичайна
+    обмежена черга майже ніколи не заповнюється. Тут місце звільняє task_done, який PTB викликає
+    після обробки оновлення, тож put (webhook, воркер, polling) чекає, поки обробка не наздожене.
+    """
+    
+    def __init__(self, limit: int):
+        super().__init__()
+        self.limit = limit
+        self._accepted = 0
+        self._released = asyncio.Event()
+    
+    def pending(self) -> int:
+        """Оновлення в черзі та в обробці"""
+        return self._accepted
+    
+    def full(self) -> bool:
+        return self._accepted >= self.limit
+    
+    async def put(self, item) -> None:
+        while self.full():
+            self._released.clear()
+            await self._released.wait()
+        self.put_nowait(item)
+    
+    def put_nowait(self, item) -> None:
+        # asyncio.Queue.put_nowait сам перевіряє full()
+        super().put_nowait(item)
+        self._accepted += 1
+    
+    def task_done(self) -> None:
+        super().task_done()
+        self._accepted -= 1
+        self._released.set()
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Обробляє оновлення різних чатів паралельно, а оновлення одного чату - строго по черзі"""
+    
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._chat_waiters: Dict[int, int] = {}
+    
+    async def process_update(self, update: object, coroutine) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await super().process_update(update, coroutine)
+            return
+        # Блокування чату береться до загального семафора, щоб один чат не займав усі слоти
+        lock = self._chat_locks.setdefault(chat.id, asyncio.Lock())
+        self._chat_waiters[chat.id] = self._chat_waiters.get(chat.id, 0) + 1
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            self._chat_waiters[chat.id] -= 1
+            if not self._chat_waiters[chat.id]:
+                del self._chat_waiters[chat.id]
+                del self._chat_locks[chat.id]
+    
+    async def do_process_update(self, update: object, coroutine) -> None:
+        await coroutine
+    
+    async def initialize(self) -> None:
+        pass
+    
+    async def shutdown(self) -> None:
+        pass
 
-# Ініціалізуємо менеджер Google Sheets
-sheets_manager = GoogleSheetsManager()
+class SendScheduler(BaseRateLimiter):
+    """Планувальник вихідних запитів Bot API у межах лімітів Telegram.
+    
+    Запити в різні чати йдуть паралельно, кожен чат має власне відро токенів, а всі разом -
+    спільне. Якщо редагування повідомлення ще чекає на токен, новіше редагування того самого
+    повідомлення заміняє його, і обидва виклики отримують результат одного запиту. Після
+    RetryAfter усі запити призупиняються на вказаний Telegram час і повторюються.
+    """
+    
+    EDIT_ENDPOINTS = {"editMessageText", "editMessageReplyMarkup"}
+    
+    def __init__(self, global_rate: float = SEND_GLOBAL_RATE, chat_rate: float = SEND_CHAT_RATE,
+                 chat_burst: float = SEND_CHAT_BURST, group_rate: float = SEND_GROUP_RATE,
+                 max_retries: int = SEND_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._edits: Dict[tuple, dict] = {}
+        self._resume_at = 0.0
+    
+    async def initialize(self) -> None:
+        pass
+    
+    async def shutdown(self) -> None:
+        pass
+    
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        if len(self._chats) > SEND_BUCKETS_SIZE:
+            for key, bucket in list(self._chats.items()):
+                if key != chat_id and bucket.is_full():
+                    del self._chats[key]
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Від'ємні ID - групи, для них Telegram обмежує кількість повідомлень за хвилину
+            bucket = TokenBucket(self.group_rate, 1) if chat_id < 0 else TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+    
+    async def _acquire(self, chat_id: Optional[int]) -> None:
+        if chat_id is None:
+            return
+        started = time.monotonic()
+        # Спершу відро чату: чат, що чекає на свою чергу, не займає спільні токени
+        await self._chat_bucket(chat_id).acquire()
+        await self._global.acquire()
+        metrics.observe("telegram_send_wait_seconds", time.monotonic() - started)
+    
+    async def _send(self, callback, args, kwargs, max_retries: int):
+        for attempt in range(max_retries + 1):
+            pause = self._resume_at - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as error:
+                metrics.inc("telegram_retry_after_total")
+                if attempt == max_retries:
+                    raise
+                logger.warning(f"Telegram обмежив частоту запитів, пауза {error.retry_after} с")
+                self._resume_at = max(self._resume_at, time.monotonic() + error.retry_after + 0.1)
+    
+    async def process_request(self, callback, args, kwargs, endpoint: str, data: dict, rate_limit_args: Optional[int]):
+        max_retries = rate_limit_args if rate_limit_args is not None else self.max_retries
+        chat_id = data.get("chat_id")
+        try:
+            chat_id = int(chat_id) if chat_id is not None else None
+        except (TypeError, ValueError):
+            # Назва каналу на зразок "@channel": рахуємо лише в спільному ліміті
+            chat_id = 0
+        
+        if endpoint not in self.EDIT_ENDPOINTS or chat_id is None or "message_id" not in data:
+            await self._acquire(chat_id)
+            return await self._send(callback, args, kwargs, max_retries)
+        
+        key = (endpoint, chat_id, data["message_id"])
+        pending = self._edits.get(key)
+        if pending is not None:
+            # Попереднє редагування ще не надіслане: надсилаємо лише найновіший вміст
+            pending["args"], pending["kwargs"] = args, kwargs
+            pending["waiters"] += 1
+            metrics.inc("telegram_edits_coalesced_total")
+            return await asyncio.shield(pending["result"])
+        entry = {"args": args, "kwargs": kwargs, "waiters": 0, "result": asyncio.get_running_loop().create_future()}
+        self._edits[key] = entry
+        try:
+            try:
+                await self._acquire(chat_id)
+            finally:
+                # Запит уже йде до Telegram: наступні редагування надсилаються окремо
+                del self._edits[key]
+            result = await self._send(callback, entry["args"], entry["kwargs"], max_retries)
+        except BaseException as error:
+            if entry["waiters"]:
+                if isinstance(error, asyncio.CancelledError):
+                    entry["result"].cancel()
+                else:
+                    entry["result"].set_exception(error)
+            raise
+        entry["result"].set_result(result)
+        return result
 
 def get_user_level(username: str) -> Optional[str]:
     """Повертає рівень доступу користувача"""
-    username = username.lower().strip()
-    if not username.startswith("@"):
-        username = f"@{username}"
-        
-    if username in {k.lower(): v for k, v in OWNERS.items()}:
-        return "owner"
-    elif username in {k.lower(): v for k, v in MANAGERS.items()}:
-        return "manager"
-    elif username in {k.lower(): v for k, v in WORKERS.items()}:
-        return "worker"
-    return None
+    entry = users.lookup(username)
+    return entry[0] if entry else None
+
+class CallbackTokens:
+    """Таблиця коротких токенів для callback_data (ліміт Telegram - 64 байти).
+    
+    Кнопка отримує callback_data виду "prefix:token", а повне значення зберігається тут.
+    Токен детермінований (хеш значення), тому однакові кнопки мають однакові дані.
+    Закріплені токени статичних меню не витісняються, решта - за TTL і LRU.
+    Незакріплені токени також зберігаються в store (SQLitePersistence), тож кнопки, показані
+    до перезапуску чи витіснені з пам'яті, працюють, доки не мине TTL.
+    """
+    
+    DIGEST_SIZE = 6
+    TOKEN_LENGTH = 8  # Довжина base64 від DIGEST_SIZE байтів
+    SAVE_INTERVAL = 60  # Як часто оновлювати в store час повторно показаної кнопки, секунд
+    
+    def __init__(self, max_size: int = CALLBACK_TOKENS_SIZE, ttl: float = CALLBACK_TOKEN_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.store: Optional[SQLitePersistence] = None
+        self._pinned: Dict[str, object] = {}
+        # data -> (значення, час створення, час останнього збереження в store)
+        self._entries: OrderedDict = OrderedDict()
+    
+    def _remember(self, data: str, payload: object, now: float, saved: float = 0.0) -> None:
+        # Час береться з годинника, а не monotonic, бо має лишатися дійсним після перезапуску
+        if self.store is not None and now - saved > self.SAVE_INTERVAL:
+            self.store.save_callback_token(data, payload, now)
+            saved = now
+        self._entries[data] = (payload, now, saved)
+        self._entries.move_to_end(data)
+    
+    def encode(self, prefix: str, payload: object, pinned: bool = False) -> str:
+        digest = hashlib.blake2b(repr(payload).encode("utf-8"), digest_size=self.DIGEST_SIZE).digest()
+        data = f"{prefix}:{base64.urlsafe_b64encode(digest).decode('ascii')}"
+        if pinned:
+            self._pinned[data] = payload
+        else:
+            entry = self._entries.get(data)
+            self._remember(data, payload, time.time(), entry[2] if entry is not None else 0.0)
+            self._evict()
+        return data
+    
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        now = time.time()
+        while self._entries:
+            data, (_, created, _) = next(iter(self._entries.items()))
+            if now - created <= self.ttl:
+                break
+            self._entries.popitem(last=False)
+    
+    def touch(self, markup: InlineKeyboardMarkup) -> bool:
+        """Продовжує життя токенів повторно показаної клавіатури; False, якщо якийсь токен уже витіснено"""
+        now = time.time()
+        alive = True
+        for row in markup.inline_keyboard:
+            for button in row:
+                data = button.callback_data
+                if data in self._pinned:
+                    continue
+                entry = self._entries.get(data)
+                if entry is not None and now - entry[1] <= self.ttl:
+                    self._remember(data, entry[0], now, entry[2])
+                elif len(data.partition(":")[2]) == self.TOKEN_LENGTH:
+                    # Статичні дані ("back", "vin:manual") не є токенами і не витісняються
+                    alive = False
+        return alive
+    
+    async def resolve(self, data: str) -> Optional[object]:
+        """Повертає значення кнопки або None, якщо токен застарів"""
+        payload = self._pinned.get(data)
+        if payload is not None:
+            return payload
+        entry = self._entries.get(data)
+        if entry is None and self.store is not None:
+            # Кнопку могли показати до перезапуску або витіснити з пам'яті
+            stored = await self.store.get_callback_token(data)
+            if stored is not None:
+                # JSON повертає кортежі (виконавець, ім'я) списками
+                payload = tuple(stored[0]) if isinstance(stored[0], list) else stored[0]
+                entry = (payload, stored[1], stored[1])
+                if time.time() - entry[1] <= self.ttl:
+                    self._entries[data] = entry
+                    self._evict()
+        if entry is None or time.time() - entry[1] > self.ttl:
+            return None
+        return entry[0]
+
+callback_tokens = CallbackTokens()
 
 def create_keyboard(items: List[str], prefix: str) -> InlineKeyboardMarkup:
-    buttons = [[InlineKeyboardButton(item, callback_data=f"{prefix}:{item}")] for item in items]
+    buttons = [[InlineKeyboardButton(item, callback_data=callback_tokens.encode(prefix, item))] for item in items]
     buttons.append([InlineKeyboardButton("Ввести вручну", callback_data=f"{prefix}:manual")])
     buttons.append([InlineKeyboardButton("🔙 Назад", callback_data="back")])
     return InlineKeyboardMarkup(buttons)
 
+def create_vin_suggestions_keyboard(suggestions: List[str], typed: Optional[str]) -> InlineKeyboardMarkup:
+    buttons = [[InlineKeyboardButton(vin, callback_data=callback_tokens.encode("vin", vin))] for vin in suggestions]
+    if typed:
+        buttons.append([InlineKeyboardButton(f"✏️ Залишити {typed}", callback_data=callback_tokens.encode("vin", typed))])
+    buttons.append([InlineKeyboardButton("Ввести вручну", callback_data="vin:manual")])
+    buttons.append([InlineKeyboardButton("🔙 Назад", callback_data="back")])
+    return InlineKeyboardMarkup(buttons)
+
 def create_model_keyboard(models: List[str]) -> InlineKeyboardMarkup:
-    buttons = [[InlineKeyboardButton(model, callback_data=f"model:{model}")] for model in models]
+    buttons = [[InlineKeyboardButton(model, callback_data=callback_tokens.encode("model", model, pinned=True))]
+               for model in models]
     buttons.append([InlineKeyboardButton("🔙 Назад", callback_data="back")])
     return InlineKeyboardMarkup(buttons)
 
+def create_executor_keyboard(user_level: str, username: str, user_name: str) -> InlineKeyboardMarkup:
+    if user_level == "owner":
+        executors = {**users.managers, **users.workers}  # Власники бачать менеджерів і працівників
+    else:  # manager
+        executors = users.workers  # Менеджери бачать тільки працівників
+    
+    buttons = []
+    # Додаємо себе для менеджера
+    if user_level == "manager":
+        buttons.append([InlineKeyboardButton(
+            f"Я ({user_name})",
+            callback_data=callback_tokens.encode("executor", (username, user_name))
+        )])
+    
+    # Додаємо інших виконавців
+    for user_id, name in executors.items():
+        buttons.append([InlineKeyboardButton(
+            name,
+            callback_data=callback_tokens.encode("executor", (user_id, name))
+        )])
+    
+    buttons.append([InlineKeyboardButton("🔙 Назад", callback_data="back")])
+    return InlineKeyboardMarkup(buttons)
+
+class KeyboardCache:
+    """LRU-кеш готових клавіатур; запис вважається недійсним, якщо змінилася його версія"""
+    
+    def __init__(self, max_size: int = KEYBOARD_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()
+    
+    def get(self, key: tuple, version: int, build) -> InlineKeyboardMarkup:
+        entry = self._entries.get(key)
+        # Клавіатуру з витісненими токенами перебудовуємо: інакше її кнопки вже не спрацюють
+        if entry is not None and entry[0] == version and callback_tokens.touch(entry[1]):
+            self._entries.move_to_end(key)
+            return entry[1]
+        markup = build()
+        self._entries[key] = (version, markup)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return markup
+    
+    def clear(self) -> None:
+        self._entries.clear()
+
+# Статичні меню змінюються лише разом з кодом, тому будуються один раз
+TESLA_MODELS_KEYBOARD = create_model_keyboard(TESLA_MODELS)
+OTHER_MODELS_KEYBOARD = create_model_keyboard(OTHER_MODELS)
+
+keyboards = KeyboardCache()
+
+def executor_keyboard(user_level: str, username: str, user_name: str) -> InlineKeyboardMarkup:
+    """Клавіатура вибору виконавця; перебудовується лише після зміни списків користувачів"""
+    # Меню власника однакове для всіх власників, меню менеджера містить його самого
+    key = ("executor", user_level, username if user_level == "manager" else "")
+    return keyboards.get(key, users.version, lambda: create_executor_keyboard(user_level, username, user_name))
+
+def work_keyboard(user_data: Dict[str, str]) -> InlineKeyboardMarkup:
+    """Клавіатура найімовірніших робіт для обраної моделі та виконавця"""
+    history = sheets_manager.history
+    model = user_data.get("model", "")
+    executor = user_data.get("executor", "")
+    return keyboards.get(
+        ("work", model, executor.lower()),
+        history.version,
+        lambda: create_keyboard(history.works.rank(model, executor, WORK_SUGGESTIONS_LIMIT), "work")
+    )
+
+def recent_values_keyboard(field: str, limit: int = RECENT_ITEMS_LIMIT) -> InlineKeyboardMarkup:
+    """Клавіатура з останніх значень поля; перебудовується лише після зміни індексу"""
+    return keyboards.get(
+        (field, limit),
+        sheets_manager.recent.version,
+        lambda: create_keyboard(sheets_manager.get_recent_values(field, limit), field)
+    )
+
+@timed
 async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Повертає до головного меню"""
     query = update.callback_query
@@ -234,6 +2520,8 @@ async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     
     username = f"@{update.effective_user.username}"
     user_level = get_user_level(username)
+    if user_level:
+        await sheets_manager.remember_chat(username, update.effective_chat.id)
     
     if user_level == "owner":
         await update.effective_message.reply_text("Меню власника:", reply_markup=OWNER_MENU)
@@ -242,9 +2530,18 @@ async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     else:
         await update.effective_message.reply_text("Меню працівника:", reply_markup=WORKER_MENU)
     
+    if "user_level" in context.user_data and "record_id" not in context.user_data:
+        funnel("abandoned")
     context.user_data.clear()
     return ConversationHandler.END
 
+@timed
+async def expired_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Повідомляє про застарілу кнопку і повертає до меню"""
+    await update.effective_message.reply_text("⌛ Ця кнопка застаріла. Почніть додавання запису знову.")
+    return await back_to_menu(update, context)
+
+@timed
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Початок взаємодії з ботом"""
     username = f"@{update.effective_user.username}"
@@ -253,6 +2550,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not user_level:
         await update.message.reply_text("⛔ У вас немає доступу до цього бота")
         return
+    await sheets_manager.remember_chat(username, update.effective_chat.id)
     
     if user_level == "owner":
         await update.message.reply_text("Меню власника:", reply_markup=OWNER_MENU)
@@ -261,57 +2559,42 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     else:
         await update.message.reply_text("Меню працівника:", reply_markup=WORKER_MENU)
 
+@timed
 async def add_record(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Починає процес додавання запису"""
     username = f"@{update.effective_user.username}"
-    user_level = get_user_level(username)
-    user_name = OWNERS.get(username) or MANAGERS.get(username) or WORKERS.get(username) or update.effective_user.full_name
+    entry = users.lookup(username)
     
-    if not user_level:
+    if not entry:
         await update.message.reply_text("⛔ У вас немає доступу")
         return ConversationHandler.END
     
+    user_level, user_name = entry
+    await sheets_manager.remember_chat(username, update.effective_chat.id)
+    user_name = user_name or update.effective_user.full_name
     context.user_data["user_level"] = user_level
     context.user_data["user_name"] = user_name
+    # Разовий ідентифікатор бесіди: повторне збереження тієї ж бесіди не створить другого запису
+    context.user_data["flow_id"] = os.urandom(8).hex()
+    funnel("model")
     
     if user_level == "worker":
         context.user_data["executor"] = username
         context.user_data["executor_name"] = user_name
         await update.message.reply_text(
             "Виберіть модель авто:",
-            reply_markup=create_model_keyboard(TESLA_MODELS)
+            reply_markup=TESLA_MODELS_KEYBOARD
         )
         return MODEL
     
     # Для власників і менеджерів показуємо вибір виконавця
-    if user_level == "owner":
-        executors = {**MANAGERS, **WORKERS}  # Власники бачать менеджерів і працівників
-    else:  # manager
-        executors = WORKERS  # Менеджери бачать тільки працівників
-    
-    buttons = []
-    # Додаємо себе для менеджера
-    if user_level == "manager":
-        buttons.append([InlineKeyboardButton(
-            f"Я ({user_name})",
-            callback_data=f"executor:{username}:{user_name}"
-        )])
-    
-    # Додаємо інших виконавців
-    for user_id, name in executors.items():
-        buttons.append([InlineKeyboardButton(
-            name,
-            callback_data=f"executor:{user_id}:{name}"
-        )])
-    
-    buttons.append([InlineKeyboardButton("🔙 Назад", callback_data="back")])
-    
     await update.message.reply_text(
         "Оберіть виконавця:",
-        reply_markup=InlineKeyboardMarkup(buttons)
+        reply_markup=executor_keyboard(user_level, username, user_name)
     )
     return MODEL
 
+@timed
 async def executor_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обробляє вибір виконавця"""
     query = update.callback_query
@@ -320,16 +2603,20 @@ async def executor_selected(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if query.data == "back":
         return await back_to_menu(update, context)
     
-    _, user_id, name = query.data.split(":", 2)
+    payload = await callback_tokens.resolve(query.data)
+    if payload is None:
+        return await expired_button(update, context)
+    user_id, name = payload
     context.user_data["executor"] = user_id
     context.user_data["executor_name"] = name
     
     await query.edit_message_text(
         "Виберіть модель авто:",
-        reply_markup=create_model_keyboard(TESLA_MODELS)
+        reply_markup=TESLA_MODELS_KEYBOARD
     )
     return MODEL
 
+@timed
 async def model_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обробляє вибір моделі"""
     query = update.callback_query
@@ -338,23 +2625,26 @@ async def model_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if query.data == "back":
         return await back_to_menu(update, context)
     
-    selected = query.data.split(":")[1]
+    selected = await callback_tokens.resolve(query.data)
+    if selected is None:
+        return await expired_button(update, context)
     context.user_data["model"] = selected
     
     if selected == "Інше (не Tesla)":
         await query.edit_message_text(
             "Виберіть модель авто:",
-            reply_markup=create_model_keyboard(OTHER_MODELS)
+            reply_markup=OTHER_MODELS_KEYBOARD
         )
         return MODEL
     
-    vins = sheets_manager.get_recent_values("vin")
+    funnel("vin")
     await query.edit_message_text(
         "Оберіть VIN або введіть вручну:",
-        reply_markup=create_keyboard(vins, "vin")
+        reply_markup=recent_values_keyboard("vin")
     )
     return VIN
 
+@timed
 async def model_manual(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обробляє ручний ввід моделі"""
     text = update.message.text.strip()
@@ -367,13 +2657,14 @@ async def model_manual(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     else:
         context.user_data["model"] = f"Інше: {text}"
     
-    vins = sheets_manager.get_recent_values("vin")
+    funnel("vin")
     await update.message.reply_text(
         "Оберіть VIN або введіть вручну:",
-        reply_markup=create_keyboard(vins, "vin")
+        reply_markup=recent_values_keyboard("vin")
     )
     return VIN
 
+@timed
 async def vin_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обробляє вибір VIN"""
     query = update.callback_query
@@ -382,15 +2673,19 @@ async def vin_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     if query.data == "back":
         return await back_to_menu(update, context)
     
-    selected = query.data.split(":")[1]
-    if selected == "manual":
+    if query.data == "vin:manual":
         await query.edit_message_text("Введіть останні 6 символів VIN:")
         return VIN
     
+    selected = await callback_tokens.resolve(query.data)
+    if selected is None:
+        return await expired_button(update, context)
+    
     context.user_data["vin"] = selected
     await query.edit_message_text(f"VIN: {selected}")
     return await show_work_options(update, context)
 
+@timed
 async def vin_manual(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обробляє ручний ввід VIN"""
     text = update.message.text.strip()
@@ -398,17 +2693,36 @@ async def vin_manual(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if text in SPECIAL_COMMANDS:
         return await handle_text_messages(update, context)
     
-    if len(text) != 6 or not text.isalnum():
+    if not text.isalnum() or len(text) > 6:
+        await update.message.reply_text("❗ Введіть рівно 6 символів VIN.")
+        return VIN
+    
+    vin = text.upper()
+    history = sheets_manager.history
+    if len(vin) == 6 and history.count_vin(vin):
+        context.user_data["vin"] = vin
+        return await show_work_options(update, context)
+    
+    suggestions = history.suggest_vins(vin)
+    if suggestions:
+        await update.message.reply_text(
+            "Схожі VIN, які вже є в базі:",
+            reply_markup=create_vin_suggestions_keyboard(suggestions, vin if len(vin) == 6 else None)
+        )
+        return VIN
+    
+    if len(vin) != 6:
         await update.message.reply_text("❗ Введіть рівно 6 символів VIN.")
         return VIN
     
-    context.user_data["vin"] = text.upper()
+    context.user_data["vin"] = vin
     return await show_work_options(update, context)
 
+@timed
 async def show_work_options(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Показує варіанти робіт"""
-    works = sheets_manager.get_recent_values("work", 6)
-    keyboard = create_keyboard(works, "work")
+    funnel("work")
+    keyboard = work_keyboard(context.user_data)
     
     if update.callback_query:
         try:
@@ -429,6 +2743,7 @@ async def show_work_options(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
     return WORK
 
+@timed
 async def work_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обробляє вибір робіт"""
     query = update.callback_query
@@ -437,8 +2752,7 @@ async def work_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     if query.data == "back":
         return await back_to_menu(update, context)
     
-    work_text = query.data.split(":")[1]
-    if work_text == "manual":
+    if query.data == "work:manual":
         try:
             await query.edit_message_text(
                 "Введіть, що було зроблено (макс. 64 символи):",
@@ -452,11 +2766,15 @@ async def work_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
             )
         return WORK
     
+    work_text = await callback_tokens.resolve(query.data)
+    if work_text is None:
+        return await expired_button(update, context)
+    
     # Перевіряємо довжину тексту роботи
     if len(work_text.encode('utf-8')) > MAX_WORK_LENGTH:
         await query.edit_message_text(
             f"❗ Опис роботи занадто довгий (макс. {MAX_WORK_LENGTH} байт). Спробуйте ще раз:",
-            reply_markup=create_keyboard(sheets_manager.get_recent_values("work", 6), "work")
+            reply_markup=work_keyboard(context.user_data)
         )
         return WORK
     
@@ -464,6 +2782,7 @@ async def work_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     await ask_for_description(update, context)
     return DESCRIPTION
 
+@timed
 async def work_manual(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обробляє ручний ввід робіт"""
     text = update.message.text.strip()
@@ -475,7 +2794,7 @@ async def work_manual(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     if len(text.encode('utf-8')) > MAX_WORK_LENGTH:
         await update.message.reply_text(
             f"❗ Опис роботи занадто довгий (макс. {MAX_WORK_LENGTH} байт). Спробуйте ще раз:",
-            reply_markup=create_keyboard(sheets_manager.get_recent_values("work", 6), "work")
+            reply_markup=work_keyboard(context.user_data)
         )
         return WORK
     
@@ -483,8 +2802,10 @@ async def work_manual(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     await ask_for_description(update, context)
     return DESCRIPTION
 
+@timed
 async def ask_for_description(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Запитує додатковий опис"""
+    funnel("description")
     message_text = "Бажаєте додати додатковий опис?"
     
     if update.callback_query:
@@ -505,6 +2826,7 @@ async def ask_for_description(update: Update, context: ContextTypes.DEFAULT_TYPE
             reply_markup=DESCRIPTION_MARKUP
         )
 
+@timed
 async def handle_description(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обробляє додатковий опис"""
     text = update.message.text.strip()
@@ -520,13 +2842,18 @@ async def handle_description(update: Update, context: ContextTypes.DEFAULT_TYPE)
     context.user_data["description"] = text
     return await save_and_confirm(update, context)
 
+@timed
 async def save_and_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Зберігає запис і підтверджує"""
     username = f"@{update.effective_user.username}"
     user_name = context.user_data["user_name"]
     user_level = context.user_data["user_level"]
     
-    record_id = sheets_manager.save_record(context.user_data, username, user_name, user_level)
+    flow_id = context.user_data.get("flow_id")
+    key = f"{update.effective_chat.id}:{flow_id}" if flow_id else None
+    record_id = await sheets_manager.save_record(context.user_data, username, user_name, user_level, key)
+    context.user_data["record_id"] = record_id
+    funnel("saved")
     
     message_text = (
         f"✅ Запис #{record_id} збережено\n"
@@ -551,6 +2878,7 @@ async def save_and_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     # Повертаємо до головного меню
     return await back_to_menu(update, context)
 
+@timed
 async def handle_text_messages(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обробляє текстові повідомлення"""
     username = f"@{update.effective_user.username}"
@@ -559,6 +2887,7 @@ async def handle_text_messages(update: Update, context: ContextTypes.DEFAULT_TYP
     if not user_level:
         await update.message.reply_text("⛔ У вас немає доступу до цього бота")
         return
+    await sheets_manager.remember_chat(username, update.effective_chat.id)
     
     text = update.message.text.strip()
     
@@ -569,18 +2898,172 @@ async def handle_text_messages(update: Update, context: ContextTypes.DEFAULT_TYP
             await back_to_menu(update, context)
         return
     
-    current_state = await context.application.persistence.get_conversation(update.effective_chat.id)
-    if current_state:
-        if current_state.get('state') == MODEL:
-            await model_manual(update, context)
-        elif current_state.get('state') == VIN:
-            await vin_manual(update, context)
-        elif current_state.get('state') == WORK:
-            await work_manual(update, context)
-        elif current_state.get('state') == DESCRIPTION:
-            await handle_description(update, context)
-    else:
-        await update.message.reply_text("Оберіть дію з меню")
+    # Сюди потрапляє лише текст поза бесідою: текст усередині бесіди обробляє ConversationHandler
+    await update.message.reply_text("Оберіть дію з меню")
+
+def format_history(records: List[Dict[str, str]]) -> str:
+    lines = []
+    for record in records:
+        line = f"#{record['id']} {record['timestamp']} — {record['model']}, VIN {record['vin']}: {record['work']}"
+        if record["executor_name"]:
+            line += f" ({record['executor_name']})"
+        if record["description"]:
+            line += f"\n    {record['description']}"
+        lines.append(line)
+    return "\n".join(lines)
+
+@timed
+async def history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показує останні роботи за VIN: /history <останні 6 символів VIN>"""
+    if not get_user_level(f"@{update.effective_user.username}"):
+        await update.message.reply_text("⛔ У вас немає доступу до цього бота")
+        return
+    
+    if len(context.args) != 1:
+        await update.message.reply_text("Використання: /history <останні 6 символів VIN>")
+        return
+    
+    vin = context.args[0].upper()
+    records = sheets_manager.history.by_vin(vin)
+    if not records:
+        await update.message.reply_text(f"Записів для VIN {vin} не знайдено")
+        return
+    
+    total = sheets_manager.history.count_vin(vin)
+    await update.message.reply_text(f"🚗 Історія VIN {vin} (останні {len(records)} з {total}):\n" + format_history(records))
+
+@timed
+async def mine(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показує останні роботи, де користувач був виконавцем"""
+    username = f"@{update.effective_user.username}"
+    if not get_user_level(username):
+        await update.message.reply_text("⛔ У вас немає доступу до цього бота")
+        return
+    
+    records = sheets_manager.history.by_executor(username)
+    if not records:
+        await update.message.reply_text("Ваших записів ще немає")
+        return
+    
+    total = sheets_manager.history.count_executor(username)
+    await update.message.reply_text(f"🛠 Ваші роботи (останні {len(records)} з {total}):\n" + format_history(records))
+
+def parse_date(value: str) -> Optional[str]:
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+def format_counter(title: str, counter: Counter, limit: int = EXPORT_SUMMARY_LIMIT) -> str:
+    lines = [title]
+    for key, count in counter.most_common(limit):
+        lines.append(f"  {key or '—'}: {count}")
+    if len(counter) > limit:
+        lines.append(f"  … ще {len(counter) - limit}")
+    return "\n".join(lines)
+
+def format_days(per_day: Counter, limit: int = EXPORT_SUMMARY_LIMIT) -> str:
+    """Розподіл за днями; для довгого періоду - за місяцями, і лише останні limit з них"""
+    title, counter = "За днями:", per_day
+    if len(per_day) > limit:
+        title, counter = "За місяцями:", Counter()
+        for day, count in per_day.items():
+            counter[day[:7]] += count
+    periods = sorted(counter.items())
+    lines = [title]
+    if len(periods) > limit:
+        lines.append(f"  … ще {len(periods) - limit} раніше")
+    lines.extend(f"  {period}: {count}" for period, count in periods[-limit:])
+    return "\n".join(lines)
+
+@timed
+async def export(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Вивантажує записи за період у CSV і надсилає підсумки: /export YYYY-MM-DD YYYY-MM-DD [виконавець]"""
+    if get_user_level(f"@{update.effective_user.username}") != "owner":
+        await update.message.reply_text("⛔ Вивантаження доступне лише власникам")
+        return
+    
+    args = context.args
+    date_from = parse_date(args[0]) if len(args) >= 2 else None
+    date_to = parse_date(args[1]) if len(args) >= 2 else None
+    if not date_from or not date_to:
+        await update.message.reply_text("Використання: /export YYYY-MM-DD YYYY-MM-DD [виконавець]")
+        return
+    executor = " ".join(args[2:]).strip('"') or None
+    # Архівні вкладки за період підтягуються з аркуша лише зараз, коли вони знадобилися
+    await sheets_manager.load_partitions(date_from, date_to)
+    
+    per_executor, per_model, per_day = Counter(), Counter(), Counter()
+    total = 0
+    # Рядки пишуться одразу у тимчасовий файл, тож у пам'яті лишаються тільки лічильники
+    with tempfile.NamedTemporaryFile(mode="w+b", suffix=".csv") as spool:
+        text = io.TextIOWrapper(spool, encoding="utf-8-sig", newline="")
+        writer = csv.writer(text)
+        # Стовпці в тому ж порядку, що й на аркуші
+        columns = [RecordIndex.FIELDS.index(field) for field in GoogleSheetsManager.HEADERS]
+        writer.writerow(GoogleSheetsManager.HEADERS)
+        for row in sheets_manager.history.iter_records(date_from, date_to, executor):
+            writer.writerow([row[pos] for pos in columns])
+            total += 1
+            per_executor[row[3] or row[2]] += 1
+            per_model[row[4]] += 1
+            per_day[row[1][:10]] += 1
+        text.flush()
+        text.detach()
+        
+        if not total:
+            await update.message.reply_text("За цей період записів немає")
+            return
+        
+        spool.seek(0)
+        suffix = f"_{executor.lstrip('@').replace(' ', '_')}" if executor else ""
+        # read_file_handle=False: файл передається потоком, а не читається цілком у пам'ять
+        document = InputFile(spool, filename=f"records_{date_from}_{date_to}{suffix}.csv", read_file_handle=False)
+        await update.message.reply_document(document=document, caption=f"Записів: {total}")
+    
+    summary = "\n\n".join([
+        f"📊 Підсумки {date_from} — {date_to}: {total} робіт",
+        format_counter("За виконавцями:", per_executor),
+        format_counter("За моделями:", per_model),
+        format_days(per_day),
+    ])
+    await update.message.reply_text(summary)
+
+async def send_summary(bot, title: str, date_from: str, date_to: str) -> None:
+    """Надсилає власникам і керівникам підсумки за період з лічильників, без перегляду всіх записів"""
+    if not sheets_manager.is_leader:
+        # Підсумки надсилає лише один воркер
+        return
+    totals = await sheets_manager.summary_totals(date_from, date_to)
+    summary = "\n\n".join([
+        f"{title}: {totals['total']['']} робіт",
+        format_counter("За виконавцями:", totals["executor"]),
+        format_counter("За моделями:", totals["model"]),
+    ])
+    for username in {**users.owners, **users.managers}:
+        chat_id = await sheets_manager.summary_chat(username)
+        if chat_id is None:
+            logger.warning(f"Невідомий чат {username}: підсумки отримає після команди /start")
+            continue
+        try:
+            await bot.send_message(chat_id, summary)
+        except Exception as e:
+            logger.error(f"Не вдалося надіслати підсумки {username}: {e}")
+
+async def send_daily_summary(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Щоденні підсумки за сьогодні"""
+    today = datetime.date.today().isoformat()
+    await send_summary(context.bot, f"📊 Підсумки за {today}", today, today)
+
+async def send_weekly_summary(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Тижневі підсумки за останні 7 днів, включно з сьогоднішнім"""
+    today = datetime.date.today()
+    week_start = (today - datetime.timedelta(days=6)).isoformat()
+    await send_summary(context.bot, f"📈 Підсумки {week_start} — {today.isoformat()}", week_start, today.isoformat())
+
+async def checkpoint_stats(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Зберігає лічильники підсумків, щоб після перезапуску дочитувати з журналу лише нові записи"""
+    await sheets_manager.checkpoint_stats()
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Логує помилки та повідомляє користувача"""
@@ -591,21 +3074,192 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             "❌ Сталася помилка. Спробуйте ще раз або зверніться до адміністратора."
         )
 
+@timed
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Скасовує поточну бесіду"""
     return await back_to_menu(update, context)
 
-def main() -> None:
-    """Запускає бота"""
-    if not BOT_TOKEN:
-        logger.error("Не встановлено змінну BOT_TOKEN!")
+async def reload_users(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Періодично підхоплює зміни у файлі користувачів"""
+    if users.maybe_reload():
+        logger.info("Список користувачів перезавантажено")
+
+async def sync_replica(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Дочитує нові рядки аркуша і звіряє черговий блок локальної копії"""
+    if not sheets_manager.is_leader:
+        # Локальну копію оновлює записувач; решта воркерів підхоплює її в follow_shared_state
         return
+    await sheets_manager.sync_replica()
+    await sheets_manager.verify_replica()
+
+async def renew_leadership(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Поновлює оренду ролі записувача або перехоплює її після зупинки попереднього записувача"""
+    await sheets_manager.elect()
+
+async def follow_shared_state(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Додає до індексів записи, збережені іншими воркерами"""
+    await sheets_manager.follow()
+
+async def on_startup(app) -> None:
+    """Будує індекси з локальної копії аркуша перед обробкою оновлень"""
+    await sheets_manager.start()
+    app.job_queue.run_repeating(sync_replica, interval=REPLICA_SYNC_INTERVAL, first=REPLICA_SYNC_INTERVAL)
+    if sheets_manager.store is not None:
+        app.job_queue.run_repeating(renew_leadership, interval=LEADER_LEASE_TTL / 3, first=LEADER_LEASE_TTL / 3)
+        app.job_queue.run_repeating(follow_shared_state, interval=FOLLOW_INTERVAL, first=FOLLOW_INTERVAL)
+    if users.path:
+        app.job_queue.run_repeating(reload_users, interval=USERS_RELOAD_INTERVAL)
+    app.job_queue.run_repeating(checkpoint_stats, interval=STATS_CHECKPOINT_INTERVAL, first=STATS_CHECKPOINT_INTERVAL)
+    if SUMMARY_TIME:
+        hour, minute = map(int, SUMMARY_TIME.split(":"))
+        # Час запису в журналі місцевий, тож і розклад - у місцевому часовому поясі
+        at = datetime.time(hour, minute, tzinfo=datetime.datetime.now().astimezone().tzinfo)
+        app.job_queue.run_daily(send_daily_summary, at)
+        # У JobQueue дні рахуються від неділі (0), а SUMMARY_WEEKDAY - від понеділка
+        app.job_queue.run_daily(send_weekly_summary, at, days=((SUMMARY_WEEKDAY + 1) % 7,))
+    metrics.set_function("update_queue_depth", app.update_queue.qsize)
+    metrics.set_function("updates_pending", app.update_queue.pending)
+    if METRICS_PORT:
+        app.bot_data["metrics_server"] = await asyncio.start_server(http_server(metrics_endpoint), METRICS_HOST, METRICS_PORT)
+        logger.info(f"Метрики доступні на http://{METRICS_HOST}:{METRICS_PORT}/metrics")
     
-    if not GOOGLE_SHEETS_CREDENTIALS_BASE64 or not GOOGLE_SHEETS_SPREADSHEET_ID:
-        logger.error("Не встановлено змінні для Google Sheets!")
-        return
+    startup = time.monotonic() - STARTED_AT
+    metrics.set("startup_seconds", startup)
+    if startup > STARTUP_BUDGET:
+        logger.warning(f"Старт зайняв {startup:.2f} с, більше за бюджет {STARTUP_BUDGET:.1f} с")
+    else:
+        logger.info(f"Бот готовий до роботи за {startup:.2f} с")
+
+async def on_shutdown(app) -> None:
+    """Завершує фонові ресурси під час зупинки бота"""
+    server = app.bot_data.pop("metrics_server", None)
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+    await sheets_manager.shutdown()
+
+async def wait_for_stop_signal() -> None:
+    """Чекає на SIGINT або SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+def is_authorized(headers: Dict[str, str]) -> bool:
+    """Перевіряє секрет webhook, який Telegram (і router) передають у заголовку"""
+    return not WEBHOOK_SECRET_TOKEN or headers.get("x-telegram-bot-api-secret-token") == WEBHOOK_SECRET_TOKEN
+
+def parse_update(body: bytes, bot=None) -> Optional[Update]:
+    try:
+        return Update.de_json(json.loads(body), bot)
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def worker_endpoint(app: Application):
+    """Обробник HTTP воркера: перевіряє шлях і секрет, кладе оновлення в обмежену чергу застосунку"""
+    async def accept(method: str, path: str, headers: Dict[str, str], body: bytes) -> Tuple[str, bytes]:
+        if method != "POST" or path != f"/{WEBHOOK_PATH}":
+            return "404 Not Found", b"not found\n"
+        if not is_authorized(headers):
+            return "403 Forbidden", b"forbidden\n"
+        update = parse_update(body, app.bot)
+        if update is None:
+            return "400 Bad Request", b"bad request\n"
+        # Черга обмежує і оновлення в обробці: якщо воркер не встигає, router чекає на відповідь, а Telegram - на router
+        await app.update_queue.put(update)
+        return "200 OK", b"ok\n"
+    return accept
+
+async def run_worker(app: Application, stop: Optional[asyncio.Event] = None) -> None:
+    """Режим worker: обробляє оновлення, які пересилає router, замість власного polling чи webhook;
+    stop замінює очікування SIGINT/SIGTERM (для тестів)"""
+    async with app:
+        await app.post_init(app)
+        await app.start()
+        server = await asyncio.start_server(http_server(worker_endpoint(app)), WEBHOOK_LISTEN, WEBHOOK_PORT)
+        logger.info(f"Воркер {WORKER_NAME} приймає оновлення на {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+        await (stop.wait() if stop is not None else wait_for_stop_signal())
+        server.close()
+        await server.wait_closed()
+        await app.stop()
+    await app.post_shutdown(app)
+
+async def run_router() -> None:
+    """Режим router: приймає webhook Telegram і пересилає оновлення воркеру за chat_id % кількість воркерів"""
+    import httpx
+    from telegram import Bot
+    
+    # Те саме впорядкування, що й у воркерах: оновлення одного чату пересилаються строго по черзі
+    processor = PerChatUpdateProcessor(CONCURRENT_UPDATES)
+    
+    async with Bot(BOT_TOKEN) as bot, httpx.AsyncClient(timeout=ROUTER_FORWARD_TIMEOUT) as client:
+        async def route(method: str, path: str, headers: Dict[str, str], body: bytes) -> Tuple[str, bytes]:
+            if method != "POST" or path != f"/{WEBHOOK_PATH}":
+                return "404 Not Found", b"not found\n"
+            if not is_authorized(headers):
+                return "403 Forbidden", b"forbidden\n"
+            update = parse_update(body)
+            if update is None:
+                return "400 Bad Request", b"bad request\n"
+            # Оновлення без чату (inline-запити тощо) закріплюються за користувачем
+            chat = update.effective_chat or update.effective_user
+            worker = WORKER_URLS[(chat.id if chat else 0) % len(WORKER_URLS)]
+            responses = []
+            
+            async def forward() -> None:
+                forward_headers = {"Content-Type": "application/json"}
+                if WEBHOOK_SECRET_TOKEN:
+                    forward_headers["X-Telegram-Bot-Api-Secret-Token"] = WEBHOOK_SECRET_TOKEN
+                responses.append(await client.post(f"{worker}/{WEBHOOK_PATH}", content=body, headers=forward_headers))
+            
+            try:
+                await processor.process_update(update, forward())
+            except httpx.HTTPError as error:
+                logger.error(f"Не вдалося переслати оновлення {update.update_id} воркеру {worker}: {error}")
+                return "502 Bad Gateway", b"worker unavailable\n"
+            if responses[0].status_code != 200:
+                logger.error(f"Воркер {worker} відповів {responses[0].status_code} на оновлення {update.update_id}")
+                return "502 Bad Gateway", b"worker error\n"
+            metrics.inc("router_forwarded_total", worker=worker)
+            return "200 OK", b"ok\n"
+        
+        await bot.set_webhook(url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET_TOKEN)
+        server = await asyncio.start_server(http_server(route), WEBHOOK_LISTEN, WEBHOOK_PORT)
+        metrics_server = None
+        if METRICS_PORT:
+            metrics_server = await asyncio.start_server(http_server(metrics_endpoint), METRICS_HOST, METRICS_PORT)
+        logger.info(f"Router пересилає оновлення {len(WORKER_URLS)} воркерам з {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+        await wait_for_stop_signal()
+        for running in (server, metrics_server):
+            if running is not None:
+                running.close()
+                await running.wait_closed()
+
+def build_application(request: Optional[BaseRequest] = None, sheets: Optional[AsyncSheetsManager] = None,
+                      scheduler: Optional[SendScheduler] = None) -> Application:
+    """Створює застосунок з усіма обробниками; request, sheets і scheduler підміняють Bot API,
+    Google Sheets і ліміти Telegram (для бенчмарків)"""
+    global sheets_manager
+    sheets_manager = sheets or AsyncSheetsManager(
+        GoogleSheetsManager(), store=SharedStore() if SHARED_STATE_PATH else None
+    )
     
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    persistence = SQLitePersistence()
+    callback_tokens.store = persistence
+    builder = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .update_queue(UpdateQueue(UPDATE_QUEUE_SIZE))
+        .concurrent_updates(PerChatUpdateProcessor(CONCURRENT_UPDATES))
+        .rate_limiter(scheduler or SendScheduler())
+        .persistence(persistence)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    app = builder.build()
     
     # Додаємо обробник помилок
     app.add_error_handler(error_handler)
@@ -636,14 +3290,61 @@ def main() -> None:
             ]
         },
         fallbacks=[CommandHandler("cancel", cancel)],
-        allow_reentry=True
+        allow_reentry=True,
+        name=CONVERSATION_NAME,
+        persistent=True
     )
     
     app.add_handler(conv_handler)
+    app.add_handler(CommandHandler("history", history))
+    app.add_handler(CommandHandler("mine", mine))
+    app.add_handler(CommandHandler("export", export))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_messages))
     
-    logger.info("Бот запущений...")
-    app.run_polling()
+    return app
+
+def main() -> None:
+    """Запускає бота"""
+    if not BOT_TOKEN:
+        logger.error("Не встановлено змінну BOT_TOKEN!")
+        return
+    
+    if BOT_MODE in ("webhook", "router") and not WEBHOOK_URL:
+        logger.error(f"Для режиму {BOT_MODE} потрібно встановити WEBHOOK_URL!")
+        return
+    
+    if BOT_MODE == "worker" and not SHARED_STATE_PATH:
+        # Без спільного стану кожен воркер сам видає ID і пише до аркуша: ID повторюються, записи дублюються
+        logger.error("Для режиму worker потрібно встановити SHARED_STATE_PATH!")
+        return
+    
+    if BOT_MODE == "router":
+        if not WORKER_URLS:
+            logger.error("Для режиму router потрібно встановити WORKER_URLS!")
+            return
+        asyncio.run(run_router())
+        return
+    
+    if not GOOGLE_SHEETS_CREDENTIALS_BASE64 or not GOOGLE_SHEETS_SPREADSHEET_ID:
+        logger.error("Не встановлено змінні для Google Sheets!")
+        return
+    
+    app = build_application()
+    
+    if BOT_MODE == "webhook":
+        logger.info(f"Бот запущений у режимі webhook на {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}...")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET_TOKEN,
+        )
+    elif BOT_MODE == "worker":
+        asyncio.run(run_worker(app))
+    else:
+        logger.info("Бот запущений...")
+        app.run_polling()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
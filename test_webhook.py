@@ -0,0 +1,165 @@
+"""Перевірка режимів webhook і worker з фейковими Telegram Bot API і Google Sheets.
+
+Надсилає оновлення HTTP-запитами в app.updater.start_webhook (те, що запускає run_webhook) і в run_worker:
+чужий секрет отримує 403, справжнє оновлення обробляється, а коли всі місця черги зайняті оновленнями
+в обробці, відповідь затримується, доки одне з них не буде оброблено.
+
+    python -m pytest -q test_webhook.py
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import unittest
+
+import httpx
+
+import bench
+
+SECRET = "webhook-secret"
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+bench.configure_environment(argparse.Namespace(users=1))
+os.environ.update({
+    "WEBHOOK_LISTEN": "127.0.0.1",
+    "WEBHOOK_PORT": str(free_port()),
+    "WEBHOOK_PATH": "telegram",
+    "WEBHOOK_SECRET_TOKEN": SECRET,
+    "UPDATE_QUEUE_SIZE": "2",
+})
+logging.disable(logging.WARNING)
+
+import bot  # noqa: E402  (конфігурація читається з оточення під час імпорту)
+
+URL = f"http://{bot.WEBHOOK_LISTEN}:{bot.WEBHOOK_PORT}/{bot.WEBHOOK_PATH}"
+CHAT_ID = 10_000
+
+def message(update_id: int, text: str = "/start", chat_id: int = CHAT_ID) -> bytes:
+    sender = {"id": chat_id, "is_bot": False, "first_name": "Bench", "username": "bench0"}
+    return json.dumps({"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "text": text,
+        "chat": {"id": chat_id, "type": "private"}, "from": sender,
+        "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}] if text.startswith("/") else [],
+    }}).encode()
+
+def headers(secret: str = SECRET) -> dict:
+    return {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret}
+
+class WebhookTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.telegram = bench.FakeTelegramRequest()
+        sheets = bot.AsyncSheetsManager(bot.GoogleSheetsManager(sheet=bench.FakeSheets(0.0, 0.0)))
+        scheduler = bot.SendScheduler(global_rate=1e6, chat_rate=1e6, chat_burst=1e6, group_rate=1e6)
+        self.app = bot.build_application(request=self.telegram, sheets=sheets, scheduler=scheduler)
+        self.client = httpx.AsyncClient(timeout=10)
+
+    async def asyncTearDown(self) -> None:
+        await self.client.aclose()
+
+    async def wait_reply(self, timeout: float = 5.0) -> dict:
+        deadline = time.perf_counter() + timeout
+        while CHAT_ID not in self.telegram.last:
+            self.assertLess(time.perf_counter(), deadline, "бот не відповів на оновлення")
+            await asyncio.sleep(0.02)
+        return self.telegram.last[CHAT_ID]
+
+    async def assert_back_pressure(self) -> None:
+        """Два повільні оновлення з різних чатів займають обидва місця, тож третій запит чекає на їх обробку"""
+        self.telegram.latency = 1.0
+        for update_id in (1, 2):
+            response = await self.client.post(URL, content=message(update_id, chat_id=CHAT_ID + update_id),
+                                              headers=headers())
+            self.assertEqual(response.status_code, 200)
+        await asyncio.sleep(0.2)
+        # PTB уже забрав обидва оновлення в обробку, але місця вони звільнять лише після неї
+        self.assertEqual(self.app.update_queue.qsize(), 0)
+        self.assertTrue(self.app.update_queue.full())
+
+        pending = asyncio.create_task(self.client.post(URL, content=message(3, chat_id=CHAT_ID + 3), headers=headers()))
+        await asyncio.sleep(0.5)
+        self.assertFalse(pending.done(), "зайняті оновленнями в обробці місця мали притримати відповідь")
+
+        response = await asyncio.wait_for(pending, timeout=5)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(self.telegram.calls["sendMessage"], 2)
+
+class RunWebhookTest(WebhookTestCase):
+    """Вбудований webhook-сервер python-telegram-bot, який запускає app.run_webhook"""
+
+    async def asyncSetUp(self) -> None:
+        await super().asyncSetUp()
+        await self.app.initialize()
+        await self.app.post_init(self.app)
+        await self.app.updater.start_webhook(
+            listen=bot.WEBHOOK_LISTEN, port=bot.WEBHOOK_PORT, url_path=bot.WEBHOOK_PATH,
+            webhook_url=URL, secret_token=bot.WEBHOOK_SECRET_TOKEN,
+        )
+
+    async def asyncTearDown(self) -> None:
+        await self.app.updater.stop()
+        if self.app.running:
+            await self.app.stop()
+        await self.app.post_shutdown(self.app)
+        await self.app.shutdown()
+        await super().asyncTearDown()
+
+    async def test_rejects_wrong_secret(self) -> None:
+        await self.app.start()
+        for secret in ("wrong", ""):
+            response = await self.client.post(URL, content=message(1), headers=headers(secret))
+            self.assertEqual(response.status_code, 403)
+        self.assertTrue(self.app.update_queue.empty())
+        self.assertEqual(self.telegram.calls["sendMessage"], 0)
+
+    async def test_processes_update(self) -> None:
+        await self.app.start()
+        response = await self.client.post(URL, content=message(1), headers=headers())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((await self.wait_reply())["text"], "Меню працівника:")
+
+    async def test_full_queue_holds_response(self) -> None:
+        await self.app.start()
+        await self.assert_back_pressure()
+
+class RunWorkerTest(WebhookTestCase):
+    """HTTP-обробник воркера, якому router пересилає оновлення"""
+
+    async def asyncSetUp(self) -> None:
+        await super().asyncSetUp()
+        self.stop = asyncio.Event()
+        self.worker = asyncio.create_task(bot.run_worker(self.app, self.stop))
+        deadline = time.perf_counter() + 5
+        while not self.app.running:
+            self.assertLess(time.perf_counter(), deadline, "воркер не запустився")
+            await asyncio.sleep(0.05)
+
+    async def asyncTearDown(self) -> None:
+        self.stop.set()
+        await asyncio.wait_for(self.worker, timeout=10)
+        await super().asyncTearDown()
+
+    async def test_rejects_wrong_secret_and_processes_update(self) -> None:
+        response = await self.client.post(URL, content=message(1), headers=headers("wrong"))
+        self.assertEqual(response.status_code, 403)
+        response = await self.client.post(URL, content=b"not json", headers=headers())
+        self.assertEqual(response.status_code, 400)
+        response = await self.client.post(f"{URL}/other", content=message(1), headers=headers())
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.telegram.calls["sendMessage"], 0)
+
+        response = await self.client.post(URL, content=message(2), headers=headers())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((await self.wait_reply())["text"], "Меню працівника:")
+
+    async def test_full_queue_holds_response(self) -> None:
+        await self.assert_back_pressure()
+
+if __name__ == "__main__":
+    unittest.main()